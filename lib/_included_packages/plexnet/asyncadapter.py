@@ -1,6 +1,10 @@
 from __future__ import absolute_import
+import os
 import time
+import select
 import socket
+import weakref
+import threading
 
 import requests
 from requests.packages.urllib3 import HTTPConnectionPool, HTTPSConnectionPool
@@ -23,6 +27,9 @@ WIN_EISCONN = 10056
 WIN_ENOTCONN = 10057
 WIN_EHOSTUNREACH = 10065
 
+ABORT_POLL_INTERVAL = 0.1
+CONNECT_ATTEMPT_DELAY = 0.25  # RFC 8305 "Connection Attempt Delay"
+
 
 def ABORT_FLAG_FUNCTION():
     return False
@@ -67,10 +74,115 @@ class AsyncTimeout(float):
 DEFAULT_TIMEOUT = AsyncTimeout(10).setConnectTimeout(10)
 
 
+class ConnectWaker(object):
+    """
+    Self-pipe that lets cancel() wake a connect that is blocked in select().
+
+    Python 2 on Windows has no socket.socketpair(), in which case the waker is
+    inert and cancellation is only noticed every ABORT_POLL_INTERVAL seconds.
+    """
+    def __init__(self):
+        self._reader = None
+        self._writer = None
+        try:
+            self._reader, self._writer = socket.socketpair()
+            self._reader.setblocking(False)
+            self._writer.setblocking(False)
+        except (AttributeError, socket.error):
+            pass
+
+    def fds(self):
+        return self._reader and [self._reader] or []
+
+    def wake(self):
+        try:
+            self._writer.send(b'x')
+        except (AttributeError, socket.error):
+            pass
+
+    def close(self):
+        for s in (self._reader, self._writer):
+            if s:
+                s.close()
+        self._reader = self._writer = None
+
+
+class AddressStats(object):
+    """
+    Connect results for each resolved address of a host, so later connections
+    prefer the address that won the last race and try failing ones last.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _entry(self, host, port, sa):
+        return self._stats.setdefault((host, port), {}).setdefault(
+            sa[0], {'successes': 0, 'failures': 0, 'connectTime': None, 'lastSuccess': 0}
+        )
+
+    def recordSuccess(self, host, port, sa, connectTime):
+        with self._lock:
+            entry = self._entry(host, port, sa)
+            entry['successes'] += 1
+            entry['failures'] = 0
+            entry['connectTime'] = connectTime
+            entry['lastSuccess'] = time.time()
+
+    def recordFailure(self, host, port, sa):
+        with self._lock:
+            self._entry(host, port, sa)['failures'] += 1
+
+    def getStats(self, host, port):
+        with self._lock:
+            return dict((ip, dict(entry)) for ip, entry in self._stats.get((host, port), {}).items())
+
+    def sortAddresses(self, host, port, addresses):
+        # Interleave address families as getaddrinfo gave them to us (RFC 8305
+        # section 4), then move the last winner to the front and anything that
+        # has been failing to the back. sort() is stable, so ties keep this order.
+        byFamily = {}
+        families = []
+        for res in addresses:
+            if res[0] not in byFamily:
+                byFamily[res[0]] = []
+                families.append(res[0])
+            byFamily[res[0]].append(res)
+
+        interleaved = []
+        while any(byFamily.values()):
+            for af in families:
+                if byFamily[af]:
+                    interleaved.append(byFamily[af].pop(0))
+
+        stats = self.getStats(host, port)
+        if not stats:
+            return interleaved
+
+        winner = max(stats, key=lambda ip: stats[ip]['lastSuccess'])
+        if not stats[winner]['lastSuccess']:
+            winner = None
+
+        def rank(res):
+            entry = stats.get(res[4][0])
+            if not entry:
+                return 1
+            if res[4][0] == winner:
+                return 0
+            return entry['failures'] and 2 or 1
+
+        interleaved.sort(key=rank)
+        return interleaved
+
+
+ADDRESS_STATS = AddressStats()
+
+
 class AsyncVerifiedHTTPSConnection(VerifiedHTTPSConnection):
     def __init__(self, *args, **kwargs):
         VerifiedHTTPSConnection.__init__(self, *args, **kwargs)
         self._canceled = False
+        self._waker = None
         self.deadline = 0
         self._timeout = AsyncTimeout(DEFAULT_TIMEOUT)
 
@@ -78,71 +190,133 @@ class AsyncVerifiedHTTPSConnection(VerifiedHTTPSConnection):
         if time.time() > self.deadline:
             raise TimeoutException('connection timed out')
 
+    def _check_canceled(self):
+        if self._canceled or ABORT_FLAG_FUNCTION():
+            raise CanceledException('Request canceled')
+
     def create_connection(self, address, timeout=None, source_address=None):
         """Connect to *address* and return the socket object.
 
-        Convenience function.  Connect to *address* (a 2-tuple ``(host,
-        port)``) and return the socket object.  Passing the optional
-        *timeout* parameter will set the timeout on the socket instance
-        before attempting to connect.  If no *timeout* is supplied, the
-        global default timeout setting returned by :func:`getdefaulttimeout`
-        is used.  If *source_address* is set it must be a tuple of (host, port)
-        for the socket to bind as a source address before making the connection.
+        Every address *host* resolves to is tried, Happy Eyeballs style (RFC
+        8305): attempts are started CONNECT_ATTEMPT_DELAY apart (or as soon as
+        the previous one fails) and run in parallel, the first to connect wins
+        and the rest are closed. Addresses are ordered by ADDRESS_STATS, so the
+        address that won last time for this host is tried first.
+
+        The connect timeout from *timeout* applies to the whole race. If
+        *source_address* is set it must be a tuple of (host, port) for the
+        socket to bind as a source address before making the connection.
         An host of '' or port 0 tells the OS to use the default.
         """
         timeout = AsyncTimeout.fromTimeout(timeout)
         self._timeout = timeout
 
         host, port = address
+        addresses = ADDRESS_STATS.sortAddresses(host, port, socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM))
+        if not addresses:
+            raise socket.error("getaddrinfo returns an empty list")
+
         err = None
-        for res in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
-            af, socktype, proto, canonname, sa = res
-            sock = None
-            try:
-                sock = socket.socket(af, socktype, proto)
-                sock.setblocking(False)  # this is obviously critical
-                self.deadline = time.time() + timeout.getConnectTimeout()
-                # sock.settimeout(timeout)
-
-                if source_address:
-                    sock.bind(source_address)
-                for msg in self._connect(sock, sa):
+        pending = {}
+        nextAttempt = 0
+        self.deadline = time.time() + timeout.getConnectTimeout()
+        self._waker = ConnectWaker()
+        wakeFds = self._waker.fds()
+        try:
+            while addresses or pending:
+                self._check_canceled()
+
+                now = time.time()
+                if addresses and (not pending or now >= nextAttempt):
+                    af, socktype, proto, canonname, sa = addresses.pop(0)
+                    sock = None
+                    try:
+                        sock = socket.socket(af, socktype, proto)
+                        sock.setblocking(False)  # this is obviously critical
+
+                        if source_address:
+                            sock.bind(source_address)
+
+                        if self._startConnect(sock, sa):
+                            ADDRESS_STATS.recordSuccess(host, port, sa, 0)
+                            sock.setblocking(True)
+                            return sock
+                    except socket.error as _:
+                        err = _
+                        ADDRESS_STATS.recordFailure(host, port, sa)
+                        self._close_socket(sock)
+                        continue
+                    except Exception:
+                        self._close_socket(sock)
+                        raise
+
+                    pending[sock] = (sa, now)
+                    nextAttempt = now + CONNECT_ATTEMPT_DELAY
+                    continue
+
+                try:
+                    self._check_timeout()
+                except TimeoutException:
+                    for sa, started in pending.values():
+                        ADDRESS_STATS.recordFailure(host, port, sa)
+                    raise
+
+                # Sleep until an attempt completes, the next attempt is due, we're
+                # woken by cancel(), or the deadline passes. The poll interval only
+                # exists so ABORT_FLAG_FUNCTION is still honoured.
+                wait = min(self.deadline - now, ABORT_POLL_INTERVAL)
+                if addresses:
+                    wait = min(wait, nextAttempt - now)
+
+                socks = list(pending)
+                readable, writable, errored = select.select(wakeFds, socks, socks, max(wait, 0))
+                for sock in set(writable + errored):
+                    sa, started = pending.pop(sock)
+                    error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error:
+                        err = socket.error(error, os.strerror(error))
+                        ADDRESS_STATS.recordFailure(host, port, sa)
+                        self._close_socket(sock)
+                        # Don't wait out the delay, go straight to the next address
+                        nextAttempt = 0
+                        continue
+
                     if self._canceled or ABORT_FLAG_FUNCTION():
+                        self._close_socket(sock)
                         raise CanceledException('Request canceled')
-                sock.setblocking(True)
-                return sock
 
-            except socket.error as _:
-                err = _
-                if sock is not None:
-                    sock.shutdown(socket.SHUT_RDWR)
-                    sock.close()
+                    ADDRESS_STATS.recordSuccess(host, port, sa, time.time() - started)
+                    sock.setblocking(True)
+                    return sock
+        finally:
+            for sock in pending:
+                self._close_socket(sock)
 
-        if err is not None:
-            raise err
-        else:
-            raise socket.error("getaddrinfo returns an empty list")
+            waker, self._waker = self._waker, None
+            waker.close()
 
-    def _connect(self, sock, sa):
-        while not self._canceled and not ABORT_FLAG_FUNCTION():
-            time.sleep(0.01)
-            self._check_timeout()  # this should be done at the beginning of each loop
-            status = sock.connect_ex(sa)
-            if not status or status in (errno.EISCONN, WIN_EISCONN):
-                break
-            elif status in (errno.EINPROGRESS, WIN_EWOULDBLOCK):
-                self.deadline = time.time() + self._timeout.getConnectTimeout()
-            # elif status in (errno.EWOULDBLOCK, errno.EALREADY) or (os.name == 'nt' and status == errno.WSAEINVAL):
-            #     pass
-            yield
+        raise err
 
-        if self._canceled or ABORT_FLAG_FUNCTION():
-            raise CanceledException('Request canceled')
+    def _close_socket(self, sock):
+        if sock is None:
+            return
 
-        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
-        if error:
-            # TODO: determine when this case can actually happen
-            raise socket.error((error,))
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+
+    def _startConnect(self, sock, sa):
+        """Start a non-blocking connect. Returns True if it connected immediately."""
+        status = sock.connect_ex(sa)
+        if not status or status in (errno.EISCONN, WIN_EISCONN):
+            return True
+
+        if status not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, WIN_EWOULDBLOCK):
+            raise socket.error(status, os.strerror(status))
+
+        return False
 
     def _new_conn(self):
         sock = self.create_connection(
@@ -154,6 +328,9 @@ class AsyncVerifiedHTTPSConnection(VerifiedHTTPSConnection):
 
     def cancel(self):
         self._canceled = True
+        waker = self._waker
+        if waker:
+            waker.wake()
 
 
 class AsyncHTTPConnection(HTTPConnection):
@@ -169,7 +346,8 @@ class AsyncHTTPConnection(HTTPConnection):
 class AsyncHTTPConnectionPool(HTTPConnectionPool):
     def __init__(self, *args, **kwargs):
         HTTPConnectionPool.__init__(self, *args, **kwargs)
-        self.connections = []
+        # Weak, so connections dropped by keep-alive pooling don't pile up here
+        self.connections = weakref.WeakSet()
 
     def _new_conn(self):
         """
@@ -189,19 +367,19 @@ class AsyncHTTPConnectionPool(HTTPConnectionPool):
             # Mark this connection as not reusable
             conn.auto_open = 0
 
-        self.connections.append(conn)
+        self.connections.add(conn)
 
         return conn
 
     def cancel(self):
-        for c in self.connections:
+        for c in list(self.connections):
             c.cancel()
 
 
 class AsyncHTTPSConnectionPool(HTTPSConnectionPool):
     def __init__(self, *args, **kwargs):
         HTTPSConnectionPool.__init__(self, *args, **kwargs)
-        self.connections = []
+        self.connections = weakref.WeakSet()
 
     def _new_conn(self):
         """
@@ -221,12 +399,12 @@ class AsyncHTTPSConnectionPool(HTTPSConnectionPool):
         extra_params['strict'] = self.strict
         connection = connection_class(host=actual_host, port=actual_port, timeout=self.timeout.connect_timeout, **extra_params)
 
-        self.connections.append(connection)
+        self.connections.add(connection)
 
         return self._prepare_conn(connection)
 
     def cancel(self):
-        for c in self.connections:
+        for c in list(self.connections):
             c.cancel()
 
 
@@ -307,17 +485,22 @@ class AsyncHTTPAdapter(HTTPAdapter):
             url = parsed.geturl()
             conn = self.poolmanager.connection_from_url(url)
 
-        self.connections.append(conn)
+        # Pooled sessions live for the whole process, so only track each
+        # connection pool once
+        if conn not in self.connections:
+            self.connections.append(conn)
         return conn
 
 
 class Session(requests.Session):
     def __init__(self, *args, **kwargs):
         requests.Session.__init__(self, *args, **kwargs)
+        self.canceled = False
         self.mount('https://', AsyncHTTPAdapter())
         self.mount('http://', AsyncHTTPAdapter())
 
     def cancel(self):
+        self.canceled = True
         for v in self.adapters.values():
             v.close()
             v.cancel()
@@ -0,0 +1,561 @@
+from __future__ import absolute_import
+import sys
+import threading
+import zlib
+
+import requests
+import six
+import six.moves.urllib.parse
+
+from . import asyncadapter
+from . import threadutils
+from . import util
+
+try:
+    import asyncio
+    import concurrent.futures
+    import ssl
+    InvalidStateError = getattr(concurrent.futures, 'InvalidStateError', RuntimeError)
+    AVAILABLE = True
+except ImportError:
+    asyncio = None
+    AVAILABLE = False
+
+
+class AsyncResponse(object):
+    """
+    Just enough of requests.Response for HttpRequest, HttpResponse and PlexServer.query()
+    """
+    def __init__(self, url, status_code, reason, headers, content, wireSize=None):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.wireSize = wireSize
+        self.encoding = requests.utils.get_encoding_from_headers(headers) or 'utf-8'
+
+    def __repr__(self):
+        return '<AsyncResponse [{0}]>'.format(self.status_code)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class Exchange(object):
+    """
+    A single request/response on the transport. Thread safe, the result is
+    delivered through a concurrent.futures.Future.
+    """
+    def __init__(self, transport, method, url, headers, body, timeout):
+        self.transport = transport
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.timeout = timeout
+        self.future = concurrent.futures.Future()
+        self.connection = None
+        self.retried = False
+
+    def result(self):
+        try:
+            return self.future.result()
+        except concurrent.futures.CancelledError:
+            raise asyncadapter.CanceledException('Request canceled: {0}'.format(util.cleanToken(self.url)))
+
+    def addDoneCallback(self, func):
+        self.future.add_done_callback(lambda f: func(self))
+
+    def cancel(self):
+        if self.transport.eventLoop.loop and not self.transport._shutdown:
+            self.transport.callSoon(self._cancel)
+        else:
+            # No loop to run on, and no connection that needs aborting
+            self._cancel()
+
+    def _cancel(self):
+        if self.future.done():
+            return
+
+        self.finish(error=asyncadapter.CanceledException('Request canceled: {0}'.format(util.cleanToken(self.url))))
+        if self.connection:
+            self.connection.abort()
+
+    def finish(self, response=None, error=None):
+        if self.future.done():
+            return
+
+        # shutdown() may finish it from another thread at the same time
+        try:
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(response)
+        except InvalidStateError:
+            pass
+
+    def getRequestBytes(self, host):
+        parsed = six.moves.urllib.parse.urlsplit(self.url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        body = self.body
+        if isinstance(body, six.text_type):
+            body = body.encode('utf-8')
+
+        headers = {'Host': host, 'Connection': 'keep-alive'}
+        headers.update(util.BASE_HEADERS)
+        headers.update(self.headers or {})
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        elif self.method in ('POST', 'PUT'):
+            headers['Content-Length'] = '0'
+
+        lines = ['{0} {1} HTTP/1.1'.format(self.method, path)]
+        lines += ['{0}: {1}'.format(k, v) for k, v in headers.items()]
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if body:
+            data += body
+
+        return data
+
+
+class HttpConnection(asyncio and asyncio.Protocol or object):
+    """
+    HTTP/1.1 client protocol, one exchange at a time. Parses the response
+    incrementally as data arrives, so no thread is ever blocked on it.
+    """
+    def __init__(self, transport, key):
+        self.owner = transport
+        self.key = key
+        self.transport = None
+        self.exchange = None
+        self.buffer = bytearray()
+        self.closed = False
+        self.reused = False
+        self.timeoutHandle = None
+        self._resetResponse()
+
+    def _resetResponse(self):
+        self.state = 'head'
+        self.status = 0
+        self.reason = ''
+        self.headers = None
+        self.remaining = 0
+        self.body = bytearray()
+        self.gotData = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._cancelTimeout()
+        self.owner._discard(self)
+
+        exchange = self.exchange
+        if not exchange:
+            return
+
+        self.exchange = None
+        if self.state == 'close':
+            self._finish(exchange, keepAlive=False)
+        elif self.reused and not self.gotData and not exchange.retried:
+            # The server closed an idle keep-alive connection just as we reused it
+            exchange.retried = True
+            self.owner._start(exchange)
+        else:
+            exchange.finish(error=requests.ConnectionError(exc or 'Connection closed by {0}'.format(util.cleanToken(exchange.url))))
+
+    def eof_received(self):
+        return False
+
+    def abort(self):
+        self.exchange = None
+        if self.transport and not self.closed:
+            self.transport.abort()
+
+    def send(self, exchange):
+        self.exchange = exchange
+        exchange.connection = self
+        self._resetResponse()
+        self._armTimeout()
+        self.transport.write(exchange.getRequestBytes(self.owner.getHostHeader(self.key)))
+
+    def _armTimeout(self):
+        # Read timeout semantics, like requests: the clock restarts whenever data arrives
+        self._cancelTimeout()
+        self.timeoutHandle = self.owner.loop.call_later(float(self.exchange.timeout), self._onTimeout)
+
+    def _cancelTimeout(self):
+        if self.timeoutHandle:
+            self.timeoutHandle.cancel()
+            self.timeoutHandle = None
+
+    def _onTimeout(self):
+        exchange = self.exchange
+        self.abort()
+        if exchange:
+            exchange.finish(error=asyncadapter.TimeoutException('Read timed out: {0}'.format(util.cleanToken(exchange.url))))
+
+    def data_received(self, data):
+        if not self.exchange:
+            return
+
+        self.gotData = True
+        self.buffer.extend(data)
+        self._armTimeout()
+        try:
+            self._parse()
+        except Exception as e:
+            exchange = self.exchange
+            self.abort()
+            if exchange:
+                exchange.finish(error=requests.ConnectionError(e))
+
+    def _parse(self):
+        while self.exchange:
+            if self.state == 'head':
+                end = self.buffer.find(b'\r\n\r\n')
+                if end < 0:
+                    return
+                self._parseHead(bytes(self.buffer[:end]))
+                del self.buffer[:end + 4]
+            elif self.state == 'body':
+                chunk = self.buffer[:self.remaining]
+                del self.buffer[:self.remaining]
+                self.body.extend(chunk)
+                self.remaining -= len(chunk)
+                if self.remaining:
+                    return
+                self._finish(self.exchange)
+            elif self.state == 'chunk-size':
+                end = self.buffer.find(b'\r\n')
+                if end < 0:
+                    return
+                self.remaining = int(bytes(self.buffer[:end]).split(b';')[0].strip(), 16)
+                del self.buffer[:end + 2]
+                self.state = self.remaining and 'chunk-data' or 'chunk-trailer'
+            elif self.state == 'chunk-data':
+                if len(self.buffer) < self.remaining + 2:
+                    return
+                self.body.extend(self.buffer[:self.remaining])
+                del self.buffer[:self.remaining + 2]
+                self.state = 'chunk-size'
+            elif self.state == 'chunk-trailer':
+                end = self.buffer.find(b'\r\n')
+                if end < 0:
+                    return
+                del self.buffer[:end + 2]
+                if end == 0:
+                    self._finish(self.exchange)
+            else:  # 'close', the body runs until the server closes the connection
+                self.body.extend(self.buffer)
+                del self.buffer[:]
+                return
+
+    def _parseHead(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        version, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+        self.status = int(status)
+        self.reason = reason
+        self.headers = requests.structures.CaseInsensitiveDict()
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name, value = name.strip(), value.strip()
+            if name in self.headers:
+                self.headers[name] += ', ' + value
+            else:
+                self.headers[name] = value
+
+        self.httpVersion = version
+
+        if 100 <= self.status < 200:
+            # Interim response, the real one follows
+            self._resetResponse()
+            return
+
+        if self.exchange.method == 'HEAD' or self.status in (204, 304):
+            self._finish(self.exchange)
+        elif 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            self.state = 'chunk-size'
+        elif 'Content-Length' in self.headers:
+            self.remaining = int(self.headers['Content-Length'])
+            self.state = 'body'
+            if not self.remaining:
+                self._finish(self.exchange)
+        else:
+            self.state = 'close'
+
+    def _finish(self, exchange, keepAlive=True):
+        self._cancelTimeout()
+        self.exchange = None
+        exchange.connection = None
+
+        connection = self.headers.get('Connection', '').lower()
+        keepAlive = keepAlive and self.state != 'close' and connection != 'close' and (self.httpVersion != 'HTTP/1.0' or connection == 'keep-alive')
+        self.state = 'done'
+
+        try:
+            content = self.owner.decode(bytes(self.body), self.headers.get('Content-Encoding', '').lower())
+        except zlib.error as e:
+            exchange.finish(error=requests.ConnectionError(e))
+            keepAlive = False
+        else:
+            exchange.finish(AsyncResponse(exchange.url, self.status, self.reason, self.headers, content, len(self.body)))
+
+        if keepAlive and not self.closed:
+            self.owner._release(self)
+        elif not self.closed:
+            self.transport.close()
+
+
+class EventLoopThread(object):
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop:
+                return self.loop
+
+            self.loop = asyncio.new_event_loop()
+            self.thread = threadutils.KillableThread(target=self._run, args=(self.loop,), name='PLEXNET-ASYNCIO')
+            self.thread.start()
+            return self.loop
+
+    def _run(self, loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+            # Don't leave connects pending when the loop is closed
+            allTasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+            pending = [task for task in allTasks(loop) if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        finally:
+            loop.close()
+
+    def callSoon(self, func, *args):
+        self.start().call_soon_threadsafe(func, *args)
+
+    def stop(self):
+        with self._lock:
+            loop, self.loop = self.loop, None
+            thread, self.thread = self.thread, None
+
+        if loop:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+
+class AsyncTransport(object):
+    """
+    Opt-in (asyncio_transport setting) HTTP transport running every request
+    on a single asyncio event loop thread, so the number of in-flight requests
+    is not tied to the number of threads. Needs Python 3, on Python 2 the
+    requests based transport is always used.
+    """
+    MAX_IDLE_PER_HOST = 4
+
+    def __init__(self):
+        self.eventLoop = EventLoopThread()
+        self.loop = None
+        self._idle = {}
+        self._active = set()
+        self._sslContext = None
+        self._lock = threading.Lock()
+        self._exchanges = set()
+        self._shutdown = False
+
+    def isEnabled(self):
+        return AVAILABLE and bool(util.INTERFACE.getPreference('asyncio_transport', False))
+
+    def callSoon(self, func, *args):
+        # Don't start another loop thread once shut down
+        if self._shutdown:
+            return
+
+        self.loop = self.eventLoop.start()
+        self.eventLoop.callSoon(func, *args)
+
+    def fetch(self, method, url, headers=None, body=None, timeout=None, params=None):
+        if params:
+            query = six.moves.urllib.parse.urlencode([(k, v) for k, v in params.items() if v is not None], doseq=True)
+            url = url + ('?' in url and '&' or '?') + query
+
+        exchange = Exchange(self, method, url, headers, body, asyncadapter.AsyncTimeout.fromTimeout(timeout))
+        with self._lock:
+            if self._shutdown:
+                exchange.future.set_exception(asyncadapter.CanceledException('Transport shut down: {0}'.format(util.cleanToken(url))))
+                return exchange
+            self._exchanges.add(exchange)
+        exchange.future.add_done_callback(lambda f: self._forget(exchange))
+
+        self.callSoon(self._start, exchange)
+        return exchange
+
+    def _forget(self, exchange):
+        with self._lock:
+            self._exchanges.discard(exchange)
+
+    def request(self, method, url, headers=None, body=None, timeout=None, params=None):
+        return self.fetch(method, url, headers, body, timeout, params).result()
+
+    def get(self, url, params=None, timeout=None, headers=None):
+        return self.request('GET', url, headers=headers, params=params, timeout=timeout)
+
+    def getKey(self, url):
+        parsed = six.moves.urllib.parse.urlsplit(url)
+        scheme = parsed.scheme.lower()
+        return (scheme, (parsed.hostname or '').lower(), parsed.port or (scheme == 'https' and 443 or 80))
+
+    def getHostHeader(self, key):
+        scheme, host, port = key
+        if ':' in host:
+            host = '[{0}]'.format(host)
+        if port == (scheme == 'https' and 443 or 80):
+            return host
+        return '{0}:{1}'.format(host, port)
+
+    def getSSLContext(self):
+        if not self._sslContext:
+            self._sslContext = ssl.create_default_context(cafile=requests.certs.where())
+        return self._sslContext
+
+    def decode(self, content, encoding):
+        if not content or encoding in ('', 'identity'):
+            return content
+        if encoding == 'gzip':
+            return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(content)
+            except zlib.error:
+                return zlib.decompress(content, -zlib.MAX_WBITS)
+        return content
+
+    # Everything below runs on the event loop thread
+
+    def _start(self, exchange):
+        if exchange.future.done():
+            return
+
+        key = self.getKey(exchange.url)
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if not connection.closed:
+                connection.reused = True
+                self._active.add(connection)
+                connection.send(exchange)
+                return
+
+        self._connect(key, exchange)
+
+    def _connect(self, key, exchange):
+        scheme, host, port = key
+        kwargs = {}
+        if scheme == 'https':
+            kwargs['ssl'] = self.getSSLContext()
+        if sys.version_info >= (3, 8):
+            kwargs['happy_eyeballs_delay'] = asyncadapter.CONNECT_ATTEMPT_DELAY
+
+        connect = self.loop.create_task(asyncio.wait_for(
+            self.loop.create_connection(lambda: HttpConnection(self, key), host, port, **kwargs),
+            exchange.timeout.getConnectTimeout()
+        ))
+        connect.add_done_callback(lambda f: self._onConnected(f, exchange))
+
+    def _onConnected(self, future, exchange):
+        if future.cancelled():
+            exchange.finish(error=asyncadapter.CanceledException('Connect canceled: {0}'.format(util.cleanToken(exchange.url))))
+            return
+
+        error = future.exception()
+        if error is not None:
+            if isinstance(error, asyncio.TimeoutError):
+                error = asyncadapter.TimeoutException('Connect timed out: {0}'.format(util.cleanToken(exchange.url)))
+            else:
+                error = requests.ConnectionError(error)
+            exchange.finish(error=error)
+            return
+
+        connection = future.result()[1]
+        if exchange.future.done():
+            connection.transport.close()
+            return
+
+        self._active.add(connection)
+        connection.send(exchange)
+
+    def _release(self, connection):
+        self._active.discard(connection)
+        idle = self._idle.setdefault(connection.key, [])
+        if len(idle) < self.MAX_IDLE_PER_HOST:
+            idle.append(connection)
+        else:
+            connection.transport.close()
+
+    def _discard(self, connection):
+        self._active.discard(connection)
+        idle = self._idle.get(connection.key)
+        if idle and connection in idle:
+            idle.remove(connection)
+
+    def _cancelHost(self, key):
+        for connection in self._idle.pop(key, []):
+            connection.abort()
+
+        for connection in list(self._active):
+            if connection.key != key:
+                continue
+            exchange = connection.exchange
+            connection.abort()
+            if exchange:
+                exchange.finish(error=asyncadapter.CanceledException('Request canceled: {0}'.format(util.cleanToken(exchange.url))))
+
+    def cancelHost(self, url):
+        if self.eventLoop.loop:
+            self.callSoon(self._cancelHost, self.getKey(url))
+
+    def _cancelAll(self):
+        for key in set(list(self._idle.keys()) + [connection.key for connection in self._active]):
+            self._cancelHost(key)
+
+    def shutdown(self):
+        with self._lock:
+            self._shutdown = True
+            exchanges = list(self._exchanges)
+
+        # Including exchanges still connecting, so no thread stays blocked in result()
+        for exchange in exchanges:
+            exchange.finish(error=asyncadapter.CanceledException('Transport shut down: {0}'.format(util.cleanToken(exchange.url))))
+
+        if not self.eventLoop.loop:
+            return
+
+        self.eventLoop.callSoon(self._cancelAll)
+        self.eventLoop.stop()
+        self.loop = None
+
+
+TRANSPORT = AsyncTransport()
@@ -17,9 +17,10 @@ class Audio(media.MediaItem):
         return not self.__eq__(other)
 
     def _setData(self, data):
-        for k, v in data.attrib.items():
-            setattr(self, k, plexobjects.PlexValue(v, self))
+        self._setAttributes(data.attrib)
 
+    def _setAttributes(self, attrs):
+        plexobjects.PlexObject._setAttributes(self, attrs)
         self.key = plexobjects.PlexValue(self.key.replace('/children', ''), self)
 
     def isMusicItem(self):
@@ -113,6 +114,9 @@ class Track(Audio):
         if self.isFullObject():
             self.moods = plexobjects.PlexItemList(data, media.Mood, media.Mood.TYPE, server=self.server)
             self.media = plexobjects.PlexMediaItemList(data, plexmedia.PlexMedia, media.Media.TYPE, initpath=self.initpath, server=self.server, media=self)
+        else:
+            if data.find(media.Media.TYPE) is not None:
+                self.media = plexobjects.PlexMediaItemList(data, plexmedia.PlexMedia, media.Media.TYPE, initpath=self.initpath, server=self.server, media=self)
 
         # data for active sessions
         self.user = self._findUser(data)
@@ -146,8 +150,8 @@ class Track(Audio):
 
     @property
     def defaultThumb(self):
-        return self.__dict__.get('thumb') or self.__dict__.get('parentThumb') or self.get('grandparentThumb')
+        return self._getAttr('thumb') or self._getAttr('parentThumb') or self.get('grandparentThumb')
 
     @property
     def defaultArt(self):
-        return self.__dict__.get('art') or self.get('grandparentArt')
+        return self._getAttr('art') or self.get('grandparentArt')
@@ -1,17 +1,20 @@
 from __future__ import absolute_import
 import sys
 import os
+import collections
 import re
 import traceback
 import requests
 import socket
-from . import threadutils
+import threading
 import six.moves.urllib.request, six.moves.urllib.parse, six.moves.urllib.error
 import mimetypes
 from . import plexobjects
 from xml.etree import ElementTree
 
 from . import asyncadapter
+from . import asynctransport
+from . import requestexecutor
 
 from . import callback
 from . import util
@@ -22,6 +25,7 @@ status_codes = requests.status_codes._codes
 
 
 DEFAULT_TIMEOUT = asyncadapter.AsyncTimeout(10).setConnectTimeout(10)
+XML_CHUNK_SIZE = 64 * 1024
 
 
 def GET(*args, **kwargs):
@@ -40,6 +44,218 @@ def Session():
     return s
 
 
+class SessionPool(object):
+    """
+    Process-wide pool of keep-alive sessions, keyed by scheme, host and port.
+
+    A session is borrowed exclusively for the duration of a single request, so
+    canceling that request only affects its own session. Canceled sessions are
+    dropped instead of being returned to the pool.
+    """
+    MAX_IDLE_PER_HOST = 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._busy = {}
+
+    def getKey(self, url):
+        parsed = six.moves.urllib.parse.urlparse(url)
+        scheme = parsed.scheme.lower()
+        return (scheme, (parsed.hostname or '').lower(), parsed.port or (scheme == 'https' and 443 or 80))
+
+    def acquire(self, url):
+        key = self.getKey(url)
+        with self._lock:
+            idle = self._idle.get(key)
+            session = idle and idle.pop() or None
+
+        if session is None:
+            session = asyncadapter.Session()
+            session.poolKey = key
+
+        # Nothing from the previous borrower should leak into this request
+        session.headers = util.BASE_HEADERS.copy()
+        session.cookies.clear()
+
+        with self._lock:
+            self._busy.setdefault(key, set()).add(session)
+
+        return session
+
+    def release(self, session):
+        key = session.poolKey
+        with self._lock:
+            self._busy.get(key, set()).discard(session)
+            if not session.canceled:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.MAX_IDLE_PER_HOST:
+                    idle.append(session)
+                    return
+
+        session.close()
+
+    def cancel(self, url):
+        # Cancel everything in flight to this host and drop the idle sessions
+        key = self.getKey(url)
+        with self._lock:
+            busy = list(self._busy.get(key, ()))
+            idle = self._idle.pop(key, [])
+
+        for session in busy + idle:
+            session.cancel()
+
+    def clear(self):
+        with self._lock:
+            idle = [session for sessions in self._idle.values() for session in sessions]
+            self._idle = {}
+
+        for session in idle:
+            session.close()
+
+
+SESSIONS = SessionPool()
+
+
+class ResponseCache(object):
+    """
+    Parsed XML of earlier GET responses, kept with their ETag/Last-Modified
+    validators so PlexServer.query() can revalidate instead of refetching.
+
+    Entries are always revalidated with the server, a cached tree is only
+    handed out on a 304. Keys never include the X-Plex-Token.
+    """
+    MAX_SIZE = 4 * 1024 * 1024  # Sum of the cached response body sizes
+    MAX_ENTRY_SIZE = MAX_SIZE // 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.size = 0
+
+    def getKey(self, url, params=None):
+        parsed = six.moves.urllib.parse.urlsplit(url)
+        query = [(k, v) for k, v in six.moves.urllib.parse.parse_qsl(parsed.query, True) if k != 'X-Plex-Token']
+        if params:
+            query += [(k, six.text_type(v)) for k, v in params.items() if v is not None and k != 'X-Plex-Token']
+
+        return (parsed.scheme.lower(), parsed.netloc.lower(), parsed.path, tuple(sorted(query)))
+
+    def getValidators(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['lastModified']:
+                headers['If-Modified-Since'] = entry['lastModified']
+
+        return headers
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if not entry:
+                return None
+
+            self._entries[key] = entry
+            return entry['tree']
+
+    def isCacheable(self, response):
+        return bool(response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    def store(self, key, response, tree, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.size -= old['size']
+
+            if not self.isCacheable(response) or size > self.MAX_ENTRY_SIZE:
+                return
+
+            self._entries[key] = {
+                'etag': response.headers.get('ETag'),
+                'lastModified': response.headers.get('Last-Modified'),
+                'tree': tree,
+                'size': size
+            }
+            self.size += size
+
+            while self.size > self.MAX_SIZE:
+                self.size -= self._entries.popitem(last=False)[1]['size']
+
+    def invalidate(self, *prefixes):
+        # Matches whole path segments, so /library/metadata/12 leaves /library/metadata/123 alone
+        with self._lock:
+            for key in list(self._entries.keys()):
+                path = key[2]
+                for prefix in prefixes:
+                    if path == prefix or path.startswith(prefix.rstrip('/') + '/'):
+                        self.size -= self._entries.pop(key)['size']
+                        break
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+class StringPool(object):
+    """
+    Makes equal XML attribute values share one string object across parsed
+    responses. Values like type, codecs, contentRating, librarySectionUUID or
+    parent/grandparent paths otherwise repeat thousands of times in big libraries.
+
+    Eviction is an approximate LRU: values go into the current generation and
+    when that fills up it becomes the previous one and the old previous
+    generation is dropped. Values found in the previous generation are moved
+    back into the current one.
+    """
+    MAX_ENTRIES = 8192  # Per generation
+    MAX_VALUE_LENGTH = 64
+
+    # Attributes that are (nearly) unique per item, pooling them only churns the pool
+    SKIP_ATTRS = frozenset((
+        'key', 'ratingKey', 'guid', 'title', 'titleSort', 'originalTitle', 'thumb', 'art', 'file',
+        'id', 'addedAt', 'updatedAt', 'lastViewedAt', 'viewOffset', 'duration', 'size'
+    ))
+
+    def __init__(self):
+        self._current = {}
+        self._previous = {}
+
+    def get(self, value):
+        pooled = self._current.get(value)
+        if pooled is not None:
+            return pooled
+
+        pooled = self._previous.get(value, value)
+
+        if len(self._current) >= self.MAX_ENTRIES:
+            self._previous = self._current
+            self._current = {}
+
+        self._current[pooled] = pooled
+        return pooled
+
+    def internAttrib(self, attrib):
+        for k, v in attrib.items():
+            if k not in self.SKIP_ATTRS and len(v) <= self.MAX_VALUE_LENGTH:
+                attrib[k] = self.get(v)
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
+
+
+STRING_POOL = StringPool()
+
+
 class RequestContext(dict):
     def __getattr__(self, attr):
         return self.get(attr)
@@ -56,12 +272,12 @@ class HttpRequest(object):
         self.path = None
         self.hasParams = '?' in url
         self.ignoreResponse = False
-        self.session = asyncadapter.Session()
-        self.session.headers = util.BASE_HEADERS.copy()
+        self.session = None
+        self.exchange = None
+        self.headers = {}
         self.currentResponse = None
         self.method = method
         self.url = url
-        self.thread = None
 
         # Use our specific plex.direct CA cert if applicable to improve performance
         # if forceCertificate or url[:5] == "https":  # TODO: ---------------------------------------------------------------------------------IMPLEMENT
@@ -71,36 +287,86 @@ class HttpRequest(object):
         #     else:
         #         self.session.cert = os.path.join(certsPath, 'ca-bundle.crt')
 
+    def acquireSession(self):
+        self.session = SESSIONS.acquire(self.url)
+        return self.session
+
+    def releaseSession(self):
+        session = self.session
+        self.session = None
+        if session:
+            SESSIONS.release(session)
+
     def removeAsPending(self):
         from . import plexapp
         util.APP.delRequest(self)
 
-    def startAsync(self, *args, **kwargs):
-        self.thread = threadutils.KillableThread(target=self._startAsync, args=args, kwargs=kwargs, name='HTTP-ASYNC:{0}'.format(self.url))
-        self.thread.start()
-        return True
+    def getMethod(self, body=None):
+        if self.method in ('PUT', 'DELETE', 'HEAD'):
+            return self.method
+        elif self.method == 'POST' or body is not None:
+            return 'POST'
+        return 'GET'
+
+    def startAsync(self, body=None, contentType=None, context=None):
+        if asynctransport.TRANSPORT.isEnabled():
+            return self._startExchange(body, contentType, context)
 
-    def _startAsync(self, body=None, contentType=None, context=None):
+        return requestexecutor.EXECUTOR.submit(self, body=body, contentType=contentType, context=context)
+
+    def _startExchange(self, body=None, contentType=None, context=None):
+        # The I/O happens on the transport's event loop, a worker is only needed to handle the response
         timeout = context and context.timeout or DEFAULT_TIMEOUT
         self.logRequest(body, timeout)
         if self._cancel:
-            return
+            return False
+
+        method = self.getMethod(body)
+        if method == 'POST':
+            self.setContentType(contentType)
+
+        self.exchange = asynctransport.TRANSPORT.fetch(method, self.url, self.headers, body or None, timeout)
+        self.exchange.addDoneCallback(
+            lambda exchange: requestexecutor.EXECUTOR.submit(self, force=True, body=body, contentType=contentType, context=context, exchange=exchange)
+        )
+        return True
+
+    def setContentType(self, contentType=None):
+        if not contentType:
+            self.headers["Content-Type"] = "application/x-www-form-urlencoded"
+        else:
+            self.headers["Content-Type"] = mimetypes.guess_type(contentType)
+
+    def _startAsync(self, body=None, contentType=None, context=None, exchange=None):
         try:
-            if self.method == 'PUT':
-                res = self.session.put(self.url, timeout=timeout, stream=True)
-            elif self.method == 'DELETE':
-                res = self.session.delete(self.url, timeout=timeout, stream=True)
-            elif self.method == 'HEAD':
-                res = self.session.head(self.url, timeout=timeout, stream=True)
-            elif self.method == 'POST' or body is not None:
-                if not contentType:
-                    self.session.headers["Content-Type"] = "application/x-www-form-urlencoded"
-                else:
-                    self.session.headers["Content-Type"] = mimetypes.guess_type(contentType)
+            self._runAsync(body, contentType, context, exchange)
+        finally:
+            # Either the response has been handled and its body read, or the
+            # request failed. The session can go back to the pool either way.
+            self.releaseSession()
 
-                res = self.session.post(self.url, data=body or None, timeout=timeout, stream=True)
+    def _runAsync(self, body=None, contentType=None, context=None, exchange=None):
+        timeout = context and context.timeout or DEFAULT_TIMEOUT
+        if not exchange:
+            self.logRequest(body, timeout)
+        if self._cancel:
+            return
+        try:
+            if exchange:
+                res = exchange.result()
             else:
-                res = self.session.get(self.url, timeout=timeout, stream=True)
+                session = self.acquireSession()
+                if self.method == 'PUT':
+                    res = session.put(self.url, headers=self.headers, timeout=timeout, stream=True)
+                elif self.method == 'DELETE':
+                    res = session.delete(self.url, headers=self.headers, timeout=timeout, stream=True)
+                elif self.method == 'HEAD':
+                    res = session.head(self.url, headers=self.headers, timeout=timeout, stream=True)
+                elif self.method == 'POST' or body is not None:
+                    self.setContentType(contentType)
+                    res = session.post(self.url, data=body or None, headers=self.headers, timeout=timeout, stream=True)
+                else:
+                    res = session.get(self.url, headers=self.headers, timeout=timeout, stream=True)
             self.currentResponse = res
 
             if self._cancel:
@@ -146,22 +412,29 @@ class HttpRequest(object):
 
         self.logRequest(body, seconds, False)
         try:
-            if self.method == 'PUT':
-                res = self.session.put(self.url, timeout=seconds, stream=True)
-            elif self.method == 'DELETE':
-                res = self.session.delete(self.url, timeout=seconds, stream=True)
-            elif self.method == 'HEAD':
-                res = self.session.head(self.url, timeout=seconds, stream=True)
-            elif self.method == 'POST' or body is not None:
-                res = self.session.post(self.url, data=body, timeout=seconds, stream=True)
+            if asynctransport.TRANSPORT.isEnabled():
+                self.exchange = asynctransport.TRANSPORT.fetch(self.getMethod(body), self.url, self.headers, body, seconds)
+                res = self.exchange.result()
             else:
-                res = self.session.get(self.url, timeout=seconds, stream=True)
+                session = self.acquireSession()
+                if self.method == 'PUT':
+                    res = session.put(self.url, headers=self.headers, timeout=seconds, stream=True)
+                elif self.method == 'DELETE':
+                    res = session.delete(self.url, headers=self.headers, timeout=seconds, stream=True)
+                elif self.method == 'HEAD':
+                    res = session.head(self.url, headers=self.headers, timeout=seconds, stream=True)
+                elif self.method == 'POST' or body is not None:
+                    res = session.post(self.url, data=body, headers=self.headers, timeout=seconds, stream=True)
+                else:
+                    res = session.get(self.url, headers=self.headers, timeout=seconds, stream=True)
 
             self.currentResponse = res
 
             if self._cancel:
                 return None
 
+            res.content  # force data to be read, so the connection can be reused
+
             util.LOG("Got a {0} from {1}".format(res.status_code, util.cleanToken(self.url)))
             # self.event = msg
             return res
@@ -170,6 +443,8 @@ class HttpRequest(object):
             util.WARN_LOG(
                 "Request errored out - URL: {0} File: {1} Line: {2} Msg: {3}".format(util.cleanToken(self.url), os.path.basename(info[0]), info[1], e.message)
             )
+        finally:
+            self.releaseSession()
 
         return None
 
@@ -213,7 +488,10 @@ class HttpRequest(object):
 
     def cancel(self):
         self._cancel = True
-        self.session.cancel()
+        if self.session:
+            self.session.cancel()
+        if self.exchange:
+            self.exchange.cancel()
         self.removeAsPending()
         self.killSocket()
 
@@ -225,7 +503,7 @@ class HttpRequest(object):
             self.url += "?" + encodedName + "=" + six.moves.urllib.parse.quote_plus(value)
 
     def addHeader(self, name, value):
-        self.session.headers[name] = value
+        self.headers[name] = value
 
     def createRequestContext(self, requestType, callback_=None):
         context = RequestContext()
@@ -287,7 +565,7 @@ class HttpResponse(object):
 
     def getBodyXml(self):
         if not self.event is None:
-            return ElementTree.fromstring(self.getBodyString())
+            return ElementTree.fromstring(self.event.content)
 
         return None
 
@@ -312,6 +590,64 @@ class HttpObjectResponse(HttpResponse, plexobjects.PlexContainer):
         self.items = plexobjects.listItems(server, path, data=data, container=self)
 
 
+def getWireSize(response):
+    wireSize = getattr(response, 'wireSize', None)
+    if wireSize is None:
+        try:
+            wireSize = response.raw.tell()
+        except Exception:
+            pass
+
+    return wireSize
+
+
+class ContentReader(object):
+    """
+    File-like view of response.iter_content(), which is what iterparse() wants
+    as a source. Chunks come out already decompressed.
+    """
+    def __init__(self, response):
+        self.response = response
+        self.chunks = response.iter_content(XML_CHUNK_SIZE)
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = next(self.chunks, b'')
+        self.size += len(chunk)
+        return chunk
+
+
+def iterXml(reader, detach=True):
+    """
+    Parses the body while it is still downloading. Yields the root element as
+    soon as its start tag has been parsed, then each of its children once complete.
+    With detach, children are removed from the root after they have been yielded.
+    """
+    root = None
+    depth = 0
+    try:
+        for event, elem in ElementTree.iterparse(reader, ('start', 'end')):
+            if event == 'start':
+                STRING_POOL.internAttrib(elem.attrib)
+                depth += 1
+                if depth == 1:
+                    root = elem
+                    yield root
+            else:
+                depth -= 1
+                if depth == 1:
+                    yield elem
+                    if detach:
+                        root.remove(elem)
+    except ElementTree.ParseError:
+        if reader.size:
+            raise
+
+    util.DEBUG_LOG('XML response: {0} bytes on the wire ({1}), {2} bytes decompressed'.format(
+        getWireSize(reader.response), reader.response.headers.get('Content-Encoding', 'identity'), reader.size
+    ))
+
+
 def addRequestHeaders(transferObj, headers=None):
     if isinstance(headers, dict):
         for header in headers:
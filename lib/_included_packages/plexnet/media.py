@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+from . import http
 from . import plexobjects
 from . import plexstream
 from . import util
@@ -54,8 +55,15 @@ class MediaItem(plexobjects.PlexObject):
         req = plexrequest.PlexRequest(self.server, '/library/metadata/{0}'.format(self.ratingKey), method='DELETE')
         req.getToStringWithTimeout(10)
         self.deleted = req.wasOK()
+        if self.deleted:
+            self.invalidateCache()
         return self.deleted
 
+    def invalidateCache(self):
+        # Listings this item shows up in may have changed as well
+        http.RESPONSE_CACHE.invalidate('/library/metadata/{0}'.format(self.ratingKey), '/hubs', '/library/sections')
+        plexobjects.RELOADS.forget('/library/metadata/{0}'.format(self.ratingKey))
+
     def exists(self):
         if self.deleted:
             return False
@@ -79,7 +87,7 @@ class Media(plexobjects.PlexObject):
     def __init__(self, data, initpath=None, server=None, video=None):
         plexobjects.PlexObject.__init__(self, data, initpath=initpath, server=server)
         self.video = video
-        self.parts = [MediaPart(elem, initpath=self.initpath, server=self.server, media=self) for elem in data]
+        self.parts = plexobjects.PlexMediaItemList(data, MediaPart, MediaPart.TYPE, initpath=self.initpath, server=self.server, media=self)
 
     def __repr__(self):
         title = self.video.title.replace(' ', '.')[0:20]
@@ -92,7 +100,7 @@ class MediaPart(plexobjects.PlexObject):
     def __init__(self, data, initpath=None, server=None, media=None):
         plexobjects.PlexObject.__init__(self, data, initpath=initpath, server=server)
         self.media = media
-        self.streams = [MediaPartStream.parse(e, initpath=self.initpath, server=server, part=self) for e in data if e.tag == 'Stream']
+        self.streams = plexobjects.PlexMediaItemList(data, MediaPartStream.parse, 'Stream', initpath=self.initpath, server=server, media=self)
 
     def __repr__(self):
         return '<%s:%s>' % (self.__class__.__name__, self.id)
@@ -24,11 +24,13 @@ class Photo(media.MediaItem):
     def markWatched(self):
         path = '/:/scrobble?key=%s&identifier=com.plexapp.plugins.library' % self.ratingKey
         self.server.query(path)
+        self.invalidateCache()
         self.reload()
 
     def markUnwatched(self):
         path = '/:/unscrobble?key=%s&identifier=com.plexapp.plugins.library' % self.ratingKey
         self.server.query(path)
+        self.invalidateCache()
         self.reload()
 
     def play(self, client):
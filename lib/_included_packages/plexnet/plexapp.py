@@ -7,6 +7,8 @@ import sys
 from . import callback
 from . import signalsmixin
 from . import simpleobjects
+from . import asynctransport
+from . import requestexecutor
 from . import util
 import six
 
@@ -25,6 +27,7 @@ def init():
     from . import myplexmanager
     util.MANAGER = myplexmanager.MANAGER
     ACCOUNT.init()
+    SERVERMANAGER.selectOptimisticServer()
 
 
 class App(signalsmixin.SignalsMixin):
@@ -35,6 +38,7 @@ class App(signalsmixin.SignalsMixin):
         self.timers = []
         from . import nowplayingmanager
         self.nowplayingmanager = nowplayingmanager.NowPlayingManager()
+        self.on('change:user', callback.Callable(self.onAccountChange))
 
     def addTimer(self, timer):
         self.timers.append(timer)
@@ -42,13 +46,16 @@ class App(signalsmixin.SignalsMixin):
     def startRequest(self, request, context, body=None, contentType=None):
         context.request = request
 
+        # Register before starting, a worker may finish the request before startAsync() returns
+        requestID = request.getIdentity()
+        self.pendingRequests[requestID] = context
+
         started = request.startAsync(body=body, contentType=contentType, context=context)
 
-        if started:
-            requestID = context.request.getIdentity()
-            self.pendingRequests[requestID] = context
-        elif context.callback:
-            context.callback(None, context)
+        if not started:
+            self.pendingRequests.pop(requestID, None)
+            if context.callback:
+                context.callback(None, context)
 
         return started
 
@@ -71,6 +78,7 @@ class App(signalsmixin.SignalsMixin):
             return
 
         del self.pendingRequests[requestID]
+        requestexecutor.EXECUTOR.discard(request)
 
     def addInitializer(self, name):
         self.initializers[name] = True
@@ -95,8 +103,20 @@ class App(signalsmixin.SignalsMixin):
         for timer in self.timers:
             timer.cancel()
 
+    def onAccountChange(self, account, reallyChanged=False):
+        if not reallyChanged:
+            return
+
+        # Items and responses carry the previous user's watch state
+        from . import http
+        from . import plexobjects
+        http.RESPONSE_CACHE.clear()
+        plexobjects.IDENTITY_MAP.clear()
+        plexobjects.RELOADS.clear()
+
     def preShutdown(self):
         from . import http
+        from . import plexobjects
         http.HttpRequest._cancel = True
         if self.pendingRequests:
             util.DEBUG_LOG('Closing down {0} App() requests...'.format(len(self.pendingRequests)))
@@ -113,6 +133,13 @@ class App(signalsmixin.SignalsMixin):
             util.DEBUG_LOG('Closing server...')
             SERVERMANAGER.selectedServer.close()
 
+        http.SESSIONS.clear()
+        http.RESPONSE_CACHE.clear()
+        http.STRING_POOL.clear()
+        plexobjects.IDENTITY_MAP.clear()
+        asynctransport.TRANSPORT.shutdown()
+        requestexecutor.EXECUTOR.shutdown()
+
     def shutdown(self):
         if self.timers:
             util.DEBUG_LOG('Waiting for {0} App() timers: Started'.format(len(self.timers)))
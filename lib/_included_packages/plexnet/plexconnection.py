@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import random
+import time
 
 from . import http
 from . import callback
@@ -35,6 +36,13 @@ class PlexConnection(object):
     SCORE_LOCAL = 2
     SCORE_SECURE = 1
 
+    # Seconds a reachability result is trusted before the connection is probed again
+    RESULT_TTL = {
+        STATE_REACHABLE: 60,
+        STATE_UNAUTHORIZED: 60
+    }
+    RESULT_TTL_DEFAULT = 10
+
     SOURCE_BY_VAL = {
         1: SOURCE_MANUAL,
         2: SOURCE_DISCOVERED,
@@ -59,6 +67,9 @@ class PlexConnection(object):
 
         self.lastTestedAt = 0
         self.hasPendingRequest = False
+        self.testStartedAt = 0
+        self.lastReachableAt = 0
+        self.rtt = None
 
         self.getScore(True)
 
@@ -139,6 +150,7 @@ class PlexConnection(object):
             context = self.request.createRequestContext("reachability", callback.Callable(self.onReachabilityResponse))
             context.server = server
             util.addPlexHeaders(self.request, server.getToken())
+            self.testStartedAt = time.time()
             self.hasPendingRequest = util.APP.startRequest(self.request, context)
             return True
 
@@ -149,18 +161,43 @@ class PlexConnection(object):
             self.request.ignoreResponse = True
             self.request.cancel()
 
-    def onReachabilityResponse(self, request, response, context):
+    def abandonReachability(self):
+        # Used when another connection has already won the reachability race.
+        # Unlike cancelReachability, any response that still makes it through
+        # is dropped, since the server has already stopped waiting for it.
+        request = self.request
+        self.request = None
         self.hasPendingRequest = False
+        if request:
+            request.ignoreResponse = True
+            request.cancel()
+
+    def isResultFresh(self, now):
+        if not self.lastTestedAt:
+            return False
+
+        return now - self.lastTestedAt < self.RESULT_TTL.get(self.state, self.RESULT_TTL_DEFAULT)
+
+    def onReachabilityResponse(self, request, response, context):
         # It's possible we may have a result pending before we were able
         # to cancel it, so we'll just ignore it.
 
         # if request.ignoreResponse:
         #     return
 
+        if request is not self.request:
+            util.DEBUG_LOG("Ignoring reachability response for abandoned test: {0}".format(self))
+            return
+
+        self.hasPendingRequest = False
+        rtt = time.time() - self.testStartedAt
+
         if response.isSuccess():
             data = response.getBodyXml()
             if data is not None and context.server.collectDataFromRoot(data):
                 self.state = self.STATE_REACHABLE
+                self.rtt = rtt
+                self.lastReachableAt = time.time()
             else:
                 # This is unexpected, but treat it as unreachable
                 util.ERROR_LOG("Unable to parse root response from {0}".format(context.server))
@@ -200,6 +237,10 @@ class PlexConnection(object):
 
         return '{0}{1}{2}'.format(self.address, path, param)
 
+    def getPotentialScore(self):
+        # The best score this connection could end up with if it turns out to be reachable
+        return self.SCORE_REACHABLE + (self.isSecure and self.SCORE_SECURE or 0) + (self.isLocal and self.SCORE_LOCAL or 0)
+
     def getScore(self, recalc=False):
         if recalc:
             self.score = 0
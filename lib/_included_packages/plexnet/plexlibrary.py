@@ -131,6 +131,12 @@ class LibrarySection(plexobjects.PlexObject):
         return plexobjects.PlexObject.getAbsolutePath(self, key)
 
     def all(self, start=None, size=None, filter_=None, sort=None, unwatched=False, type_=None):
+        return plexobjects.listItems(self.server, self.getAllPath(start, size, filter_, sort, unwatched, type_))
+
+    def iterAll(self, start=None, size=None, filter_=None, sort=None, unwatched=False, type_=None):
+        return plexobjects.iterItems(self.server, self.getAllPath(start, size, filter_, sort, unwatched, type_))
+
+    def getAllPath(self, start=None, size=None, filter_=None, sort=None, unwatched=False, type_=None):
         if self.key.startswith('/'):
             path = '{0}/all'.format(self.key)
         else:
@@ -157,7 +163,7 @@ class LibrarySection(plexobjects.PlexObject):
         if args:
             path += util.joinArgs(args)
 
-        return plexobjects.listItems(self.server, path)
+        return path
 
     def jumpList(self, filter_=None, sort=None, unwatched=False, type_=None):
         if self.key.startswith('/'):
@@ -462,7 +468,7 @@ class BaseHub(plexobjects.PlexObject):
 class Hub(BaseHub):
     TYPE = "Hub"
 
-    def init(self, data):
+    def init(self, data, shared=True):
         self.items = []
 
         container = plexobjects.PlexContainer(data, self.key, self.server, self.key or '')
@@ -476,7 +482,7 @@ class Hub(BaseHub):
         else:
             for elem in data:
                 try:
-                    self.items.append(plexobjects.buildItem(self.server, elem, '/hubs', container=container, tag_fallback=True))
+                    self.items.append(plexobjects.buildItem(self.server, elem, '/hubs', container=container, tag_fallback=True, shared=shared))
                 except exceptions.UnknownType:
                     util.DEBUG_LOG('Unkown hub item type({1}): {0}'.format(elem, elem.attrib.get('type')))
 
@@ -522,6 +528,15 @@ class Hub(BaseHub):
         return items
 
 
+class CachedHub(Hub):
+    """
+    A Hub rebuilt from the hub cache. Its items are its own, so data that may
+    be days old never merges into, or drops watch state from, the shared items.
+    """
+    def init(self, data):
+        Hub.init(self, data, shared=False)
+
+
 class PlaylistHub(BaseHub):
     TYPE = "Hub"
     type = None
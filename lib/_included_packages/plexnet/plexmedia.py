@@ -19,7 +19,7 @@ class PlexMedia(plexobjects.PlexObject):
         self.parts = []
         # If we weren't given any data, this is a synthetic media
         if data is not None:
-            self.parts = [plexpart.PlexPart(elem, initpath=self.initpath, server=self.server, media=self) for elem in data]
+            self.parts = plexobjects.PlexMediaItemList(data, plexpart.PlexPart, 'Part', initpath=self.initpath, server=self.server, media=self)
 
     def get(self, key, default=None):
         return self._data.get(key, default)
@@ -1,5 +1,12 @@
 from __future__ import absolute_import
 from datetime import datetime
+from xml.etree import ElementTree
+import array
+import collections
+import threading
+import time
+import weakref
+import zlib
 
 from . import exceptions
 from . import util
@@ -19,6 +26,13 @@ SEARCHTYPES = {
 
 LIBRARY_TYPES = {}
 
+# PlexObject.serialize() format
+SERIALIZE_MAGIC = b'PX'
+SERIALIZE_VERSION = 1
+SERIALIZE_MAX_AGE = 600  # How long serialized full state is used instead of reloading
+
+RELOAD_BATCH_SIZE = 20  # Items per /library/metadata/<id>,<id>,... query in reloadMany()
+
 
 def registerLibType(cls):
     LIBRARY_TYPES[cls.TYPE] = cls
@@ -138,6 +152,14 @@ class Checks(object):
 
 
 class PlexObject(Checks):
+    # The element's attrib dict. PlexValues are only created for the attributes
+    # that are actually accessed, see _setAttributes() and __getattr__()
+    _attrs = None
+    _naValue = None
+
+    # Left out of the XML instead of being reset, see _mergeData()
+    WATCH_STATE_ATTRS = ('viewCount', 'viewOffset', 'lastViewedAt')
+
     def __init__(self, data, initpath=None, server=None, container=None):
         self.initpath = initpath
         self.key = None
@@ -160,26 +182,77 @@ class PlexObject(Checks):
             return
 
         self.name = data.tag
-        for k, v in data.attrib.items():
-            setattr(self, k, PlexValue(v, self))
+        self._setAttributes(data.attrib)
+
+    def _setAttributes(self, attrs):
+        if self._attrs:
+            # Reloading, attributes missing from the new data keep their old value
+            merged = dict(self._attrs)
+            merged.update(attrs)
+            self._attrs = merged
+        else:
+            self._attrs = attrs
+
+        # Anything already on the instance or the class would shadow the lazy
+        # lookup, so those are still set right away
+        cls = self.__class__
+        for k, v in attrs.items():
+            if k in self.__dict__ or hasattr(cls, k):
+                setattr(self, k, PlexValue(v, self))
+
+    def _dropMissingWatchState(self, data):
+        for attr in self.WATCH_STATE_ATTRS:
+            if attr not in data.attrib and self._attrs and attr in self._attrs:
+                delattr(self, attr)
+
+    def _mergeData(self, data, initpath):
+        # Newer data for this item from another listing, see IdentityMap
+        self._dropMissingWatchState(data)
+
+        if initpath is not None and initpath == data.attrib.get('key'):
+            self.initpath = initpath
+            self._setData(data)
+        else:
+            # Partial data, keep any media and tags of a full object
+            self._setAttributes(data.attrib)
 
-    def __getattr__(self, attr):
-        a = PlexValue('', self)
-        a.NA = True
+    def _getAttr(self, attr):
+        # self.__dict__.get(attr) that also sees attributes not accessed yet
+        ret = self.__dict__.get(attr)
+        if ret is None and self._attrs and attr in self._attrs:
+            ret = PlexValue(self._attrs[attr], self)
+            setattr(self, attr, ret)
+        return ret
 
-        try:
+    def __getattr__(self, attr):
+        if self._attrs and attr in self._attrs:
+            a = PlexValue(self._attrs[attr], self)
             setattr(self, attr, a)
-        except AttributeError:
-            util.LOG('Failed to set attribute: {0} ({1})'.format(attr, self.__class__))
-
-        return a
+            return a
+
+        # Missing attributes all share one NA value and are not stored, so
+        # probing for them leaves nothing behind on the instance
+        if self._naValue is None:
+            self._naValue = PlexValue('', self)
+            self._naValue.NA = True
+
+        return self._naValue
+
+    def __delattr__(self, attr):
+        if self._attrs and attr in self._attrs:
+            # Copy first, the dict may still be the element's own attrib
+            self._attrs = dict(self._attrs)
+            del self._attrs[attr]
+            self.__dict__.pop(attr, None)
+        else:
+            object.__delattr__(self, attr)
 
     def exists(self):
         # Used for media items - for others we just return True
         return True
 
     def get(self, attr, default=''):
-        ret = self.__dict__.get(attr)
+        ret = self._getAttr(attr)
         return ret is not None and ret or PlexValue(default, self)
 
     def set(self, attr, value):
@@ -200,11 +273,11 @@ class PlexObject(Checks):
 
     @property
     def defaultThumb(self):
-        return self.__dict__.get('thumb') and self.thumb or PlexValue('', self)
+        return self._getAttr('thumb') and self.thumb or PlexValue('', self)
 
     @property
     def defaultArt(self):
-        return self.__dict__.get('art') and self.art or PlexValue('', self)
+        return self._getAttr('art') and self.art or PlexValue('', self)
 
     def refresh(self):
         import requests
@@ -219,9 +292,9 @@ class PlexObject(Checks):
 
         try:
             if self.get('ratingKey'):
-                data = self.server.query('/library/metadata/{0}'.format(self.ratingKey), params=kwargs)
+                data = RELOADS.query(self.server, '/library/metadata/{0}'.format(self.ratingKey), kwargs, soft=_soft)
             else:
-                data = self.server.query(self.key, params=kwargs)
+                data = RELOADS.query(self.server, self.key, kwargs, soft=_soft)
             self._reloaded = True
         except Exception as e:
             import traceback
@@ -362,7 +435,30 @@ class PlexObject(Checks):
         return server
 
     @classmethod
-    def deSerialize(cls, jstring):
+    def deSerialize(cls, data):
+        if not data.startswith(SERIALIZE_MAGIC):
+            return cls.deSerializeJSON(data)
+
+        from . import plexserver
+        version, created, serverData, packed = json.loads(zlib.decompress(data[len(SERIALIZE_MAGIC):]).decode('utf-8'))
+        if version != SERIALIZE_VERSION:
+            raise exceptions.UnknownType('Unknown serialization version: {0}'.format(version))
+
+        server = plexserver.PlexServer.deSerialize(serverData)
+        server.identifier = None
+        elem = unpackElement(packed)
+
+        # With its media the object is complete, so build it as a full object
+        initpath = len(elem) and elem.get('key') or '/none'
+        po = buildItem(server, elem, initpath, container=server)
+
+        if len(elem) and time.time() - created < SERIALIZE_MAX_AGE:
+            po._reloaded = True
+
+        return po
+
+    @classmethod
+    def deSerializeJSON(cls, jstring):
         from . import plexserver
         obj = json.loads(jstring)
         server = plexserver.PlexServer.deSerialize(obj['server'])
@@ -375,11 +471,32 @@ class PlexObject(Checks):
         return po
 
     def serialize(self, full=False):
-        import json
+        """
+        Returns a compact, versioned snapshot of this object for passing to the
+        plugin entry point. It carries the object's attributes and media, so
+        deSerialize() can skip the reload for SERIALIZE_MAX_AGE seconds.
+        """
+        attrib = dict(self._attrs or {})
+        for k, v in self.__dict__.items():
+            if isinstance(v, PlexValue) and v:
+                attrib[k] = v
+
+        children = []
+        media = self.__dict__.get('media')
+        if isinstance(media, PlexItemList) and media._data is not None:
+            children = [packElement(elem) for elem in media._data if elem.tag == media._itemTag]
+
+        tag = self.name or self.__class__.__name__
+        data = [SERIALIZE_VERSION, int(time.time()), self.server.serialize(full=full), [tag, attrib, children]]
+        return SERIALIZE_MAGIC + zlib.compress(json.dumps(data, cls=JEncoder, separators=(',', ':')).encode('utf-8'))
+
+    def serializeJSON(self, full=False):
         odict = {}
         if full:
-            for k, v in self.__dict__.items():
-                if k not in ('server', 'container', 'media', 'initpath', '_data') and v:
+            attrs = dict(self._attrs or {})
+            attrs.update(self.__dict__)
+            for k, v in attrs.items():
+                if k not in ('server', 'container', 'media', 'initpath', '_data', '_attrs', '_naValue') and v:
                     odict[k] = v
         else:
             odict['key'] = self.key
@@ -391,6 +508,17 @@ class PlexObject(Checks):
         return json.dumps(obj, cls=JEncoder)
 
 
+def packElement(elem):
+    return [elem.tag, dict(elem.attrib), [packElement(child) for child in elem]]
+
+
+def unpackElement(packed):
+    tag, attrib, children = packed
+    elem = ElementTree.Element(tag, attrib)
+    elem.extend([unpackElement(child) for child in children])
+    return elem
+
+
 class PlexContainer(PlexObject):
     def __init__(self, data, initpath=None, server=None, address=None):
         PlexObject.__init__(self, data, initpath, server)
@@ -470,6 +598,9 @@ class PlexItemList(object):
     def append(self, item):
         self.items.append(item)
 
+    def columns(self):
+        return ItemColumns(self.items)
+
 
 class PlexMediaItemList(PlexItemList):
     def __init__(self, data, item_cls, tag, initpath=None, server=None, media=None):
@@ -496,17 +627,196 @@ def findItem(server, path, title):
     raise exceptions.NotFound('Unable to find item: {0}'.format(title))
 
 
-def buildItem(server, elem, initpath, bytag=False, container=None, tag_fallback=False):
+def buildItem(server, elem, initpath, bytag=False, container=None, tag_fallback=False, shared=True):
+    # Items built with shared=False stay out of IDENTITY_MAP, for data that must not update the shared items
     libtype = elem.tag if bytag else elem.attrib.get('type')
     if not libtype and tag_fallback:
         libtype = elem.tag
 
     if libtype in LIBRARY_TYPES:
-        cls = LIBRARY_TYPES[libtype]
-        return cls(elem, initpath=initpath, server=server, container=container)
+        if not shared:
+            return LIBRARY_TYPES[libtype](elem, initpath=initpath, server=server, container=container)
+        return IDENTITY_MAP.build(LIBRARY_TYPES[libtype], server, elem, initpath, container)
     raise exceptions.UnknownType('Unknown library type: {0}'.format(libtype))
 
 
+def reloadMany(items, **kwargs):
+    """
+    Reloads items like PlexObject.reload() does, but with one query per
+    RELOAD_BATCH_SIZE items, using PMS's comma separated ratingKeys.
+    Items that are missing from the response are left as they were.
+    """
+    kwargs["includeMarkers"] = 1
+
+    # PlexServer isn't hashable, group by id()
+    servers = collections.OrderedDict()
+    for item in items:
+        ratingKey = item.get('ratingKey')
+        if ratingKey:
+            server, byRatingKey = servers.setdefault(id(item.server), (item.server, collections.OrderedDict()))
+            byRatingKey.setdefault(ratingKey, []).append(item)
+
+    for server, byRatingKey in servers.values():
+        ratingKeys = list(byRatingKey.keys())
+        for start in range(0, len(ratingKeys), RELOAD_BATCH_SIZE):
+            batch = ratingKeys[start:start + RELOAD_BATCH_SIZE]
+            try:
+                data = server.query('/library/metadata/{0}'.format(','.join(batch)), params=kwargs)
+            except Exception as e:
+                util.ERROR(err=e)
+                continue
+
+            if data is None:
+                # Timed out, canceled or cut short
+                continue
+
+            for elem in data:
+                for item in byRatingKey.get(elem.attrib.get('ratingKey'), ()):
+                    item._dropMissingWatchState(elem)
+                    item.initpath = item.key
+                    item._setData(elem)
+                    item._reloaded = True
+
+    return items
+
+
+class ReloadFlight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces PlexObject.reload() queries. Reloads of the same path and params
+    that overlap share one request and all of them get its result. Soft reloads
+    also reuse a result that is less than FRESH_TIME seconds old.
+    """
+    FRESH_TIME = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._recent = {}
+
+    def getKey(self, server, path, params):
+        return (server.uuid or id(server), path, tuple(sorted(params.items())))
+
+    def query(self, server, path, params, soft=False):
+        key = self.getKey(server, path, params)
+        with self._lock:
+            if soft:
+                recent = self._recent.get(key)
+                if recent and time.time() - recent[0] < self.FRESH_TIME:
+                    return recent[1]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = ReloadFlight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error:
+                raise flight.error
+            return flight.data
+
+        try:
+            flight.data = server.query(path, params=params)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # forget() may already have let a newer flight take this key
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if flight.error is None:
+                        self._recent[key] = (time.time(), flight.data)
+
+                now = time.time()
+                for k in [k for k, r in self._recent.items() if now - r[0] >= self.FRESH_TIME]:
+                    del self._recent[k]
+
+            flight.event.set()
+
+        return flight.data
+
+    def forget(self, path):
+        # The item changed on the server, don't hand out older results for it
+        with self._lock:
+            for key in list(self._flights.keys()):
+                if key[1] == path:
+                    del self._flights[key]
+            for key in list(self._recent.keys()):
+                if key[1] == path:
+                    del self._recent[key]
+
+    def clear(self):
+        with self._lock:
+            self._flights.clear()
+            self._recent.clear()
+
+
+RELOADS = SingleFlight()
+
+
+class IdentityMap(object):
+    """
+    Keeps one PlexObject per (server uuid, ratingKey) for as long as anything
+    still references it. buildItem() merges newer data for an item into the
+    existing object instead of building another copy, so hubs, library views
+    and reloads share watched state and soft reload state.
+
+    Play queue and playlist entries are left out, the same item can be in
+    those more than once with different IDs. So are elements without a type,
+    which can't be told apart from other kinds of items with the same ratingKey.
+    """
+    SKIP_ATTRS = ('playQueueItemID', 'playlistItemID')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = weakref.WeakValueDictionary()
+
+    def getKey(self, server, elem):
+        uuid = getattr(server, 'uuid', None)
+        ratingKey = elem.attrib.get('ratingKey')
+        if not uuid or not ratingKey or not elem.attrib.get('type'):
+            return None
+
+        for attr in self.SKIP_ATTRS:
+            if attr in elem.attrib:
+                return None
+
+        return (uuid, ratingKey)
+
+    def build(self, cls, server, elem, initpath, container):
+        key = self.getKey(server, elem)
+        if not key:
+            return cls(elem, initpath=initpath, server=server, container=container)
+
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is not None and type(obj) is cls and obj._attrs.get('type') == elem.attrib.get('type'):
+                # Servers are rebuilt when the user changes, use the current one
+                obj.server = server
+                obj._mergeData(elem, initpath)
+                return obj
+
+            obj = cls(elem, initpath=initpath, server=server, container=container)
+            self._objects[key] = obj
+
+        return obj
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+IDENTITY_MAP = IdentityMap()
+
+
 class ItemContainer(list):
     def __getattr__(self, attr):
         return getattr(self.container, attr)
@@ -515,6 +825,67 @@ class ItemContainer(list):
         self.container = container
         return self
 
+    def columns(self):
+        return ItemColumns(self)
+
+
+class ItemColumns(object):
+    """
+    Reads one attribute of every item in a list into a typed array in a single
+    pass, straight from the raw attribute strings, instead of building and
+    converting a PlexValue per item. Entries that aren't PlexObjects, like the
+    None/False placeholders of library chunks, get the default.
+    """
+    def __init__(self, items):
+        self.items = items
+
+    def _raw(self, attr):
+        for item in self.items:
+            if not isinstance(item, PlexObject):
+                yield None
+                continue
+
+            value = item.__dict__.get(attr)
+            if value is None and item._attrs:
+                value = item._attrs.get(attr)
+            yield value
+
+    def ints(self, attr, default=0):
+        return array.array('l', (value and int(value) or default for value in self._raw(attr)))
+
+    def timestamps(self, attr):
+        # Seconds since the epoch, for both epoch and YYYY-MM-DD attributes. 0 if missing or malformed.
+        col = array.array('d')
+        for value in self._raw(attr):
+            if not value:
+                col.append(0)
+            elif value.isdigit():
+                col.append(int(value))
+            else:
+                try:
+                    col.append(time.mktime(time.strptime(value, '%Y-%m-%d')))
+                except (ValueError, OverflowError):
+                    col.append(0)
+        return col
+
+    def durations(self):
+        # MediaItem.fixedDuration() for every item
+        col = self.ints('duration')
+        for i, duration in enumerate(col):
+            if duration < 1000:
+                col[i] = duration * 60000
+        return col
+
+
+def _wantItem(elem, libtype=None, watched=None):
+    if libtype and elem.attrib.get('type') != libtype:
+        return False
+    if watched is True and elem.attrib.get('viewCount', 0) == 0:
+        return False
+    if watched is False and elem.attrib.get('viewCount', 0) >= 1:
+        return False
+    return True
+
 
 def listItems(server, path, libtype=None, watched=None, bytag=False, data=None, container=None):
     data = data if data is not None else server.query(path)
@@ -522,11 +893,7 @@ def listItems(server, path, libtype=None, watched=None, bytag=False, data=None,
     items = ItemContainer().init(container)
 
     for elem in data:
-        if libtype and elem.attrib.get('type') != libtype:
-            continue
-        if watched is True and elem.attrib.get('viewCount', 0) == 0:
-            continue
-        if watched is False and elem.attrib.get('viewCount', 0) >= 1:
+        if not _wantItem(elem, libtype, watched):
             continue
         try:
             items.append(buildItem(server, elem, path, bytag, container))
@@ -536,6 +903,49 @@ def listItems(server, path, libtype=None, watched=None, bytag=False, data=None,
     return items
 
 
+def iterItems(server, path, libtype=None, watched=None, bytag=False, container=None):
+    """
+    Streaming version of listItems(). Each item is built as soon as its element
+    has been parsed, while the rest of the response is still downloading.
+    Returns an ItemStream, whose complete flag is False if the response was cut short.
+    """
+    data = server.iterQuery(path)
+    return ItemStream(data, _iterItems(data, server, path, libtype, watched, bytag, container))
+
+
+class ItemStream(object):
+    def __init__(self, data, items):
+        self._data = data
+        self._items = items
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    next = __next__
+
+    @property
+    def complete(self):
+        return self._data.complete
+
+
+def _iterItems(data, server, path, libtype, watched, bytag, container):
+    root = next(data, None)
+    if root is None:
+        return
+
+    container = container or PlexContainer(root, path, server, path)
+    for elem in data:
+        if not _wantItem(elem, libtype, watched):
+            continue
+        try:
+            yield buildItem(server, elem, path, bytag, container)
+        except exceptions.UnknownType:
+            pass
+
+
 def searchType(libtype):
     searchtypesstrs = [str(k) for k in SEARCHTYPES.keys()]
     if libtype in SEARCHTYPES + searchtypesstrs:
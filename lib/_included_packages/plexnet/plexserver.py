@@ -8,13 +8,13 @@ from . import compat
 from . import verlib
 import re
 import json
-from xml.etree import ElementTree
 
 from . import signalsmixin
 from . import plexobjects
 from . import plexresource
 from . import plexlibrary
 from . import asyncadapter
+from . import asynctransport
 from six.moves import range
 # from plexapi.client import Client
 # from plexapi.playqueue import PlayQueue
@@ -24,6 +24,24 @@ TOTAL_QUERIES = 0
 DEFAULT_BASEURI = 'http://localhost:32400'
 
 
+class QueryStream(object):
+    def __init__(self, server, path, method, kwargs):
+        self._state = {}
+        self._elements = server._iterQuery(path, method, kwargs, True, self._state)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._elements)
+
+    next = __next__
+
+    @property
+    def complete(self):
+        return bool(self._state.get('complete'))
+
+
 class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
     TYPE = 'PLEXSERVER'
 
@@ -42,6 +60,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         self.allowsMediaDeletion = False
         self.allowChannelAccess = False
         self.activeConnection = None
+        self.savedConnection = None
         self.serverClass = None
 
         self.pendingReachabilityRequests = 0
@@ -97,6 +116,9 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
 
     def close(self):
         self.session.cancel()
+        for conn in self.connections:
+            http.SESSIONS.cancel(conn.address)
+            asynctransport.TRANSPORT.cancelHost(conn.address)
 
     def get(self, attr, default=None):
         return default
@@ -110,7 +132,12 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         data = self.query(key)
         return plexobjects.buildItem(self, data[0], key, container=self)
 
-    def hubs(self, section=None, count=None, search_query=None):
+    def hubs(self, section=None, count=None, search_query=None, packed=None):
+        """
+        With packed, the container and hub elements are appended to it as
+        plexobjects.packElement() data, which hubsFromPacked() turns back into
+        the same hubs without a request.
+        """
         hubs = []
 
         params = {"includeMarkers": 1}
@@ -139,13 +166,32 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             if count is not None:
                 params['count'] = count
 
-        data = self.query(q, params=params)
-        container = plexobjects.PlexContainer(data, initpath=q, server=self, address=q)
+        data = self.iterQuery(q, params=params)
+        root = next(data, None)
+        if root is None:
+            return hubs
+
+        container = plexobjects.PlexContainer(root, initpath=q, server=self, address=q)
+        if packed is not None:
+            # Just the container, its children may or may not have been parsed yet
+            packed.append([root.tag, dict(root.attrib), []])
 
         for elem in data:
+            if packed is not None:
+                packed.append(plexobjects.packElement(elem))
             hubs.append(plexlibrary.Hub(elem, server=self, container=container))
+
+        if packed is not None and not data.complete:
+            # Don't let a truncated response be kept as the last known hubs
+            del packed[:]
+
         return hubs
 
+    def hubsFromPacked(self, packed, section=None):
+        q = section and '/hubs/sections/%s' % section or '/hubs'
+        container = plexobjects.PlexContainer(plexobjects.unpackElement(packed[0]), initpath=q, server=self, address=q)
+        return [plexlibrary.CachedHub(plexobjects.unpackElement(p), server=self, container=container) for p in packed[1:]]
+
     def playlists(self, start=0, size=10, hub=None):
         try:
             return plexobjects.listItems(self, '/playlists/all')
@@ -167,33 +213,101 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             return ""
 
     def query(self, path, method=None, **kwargs):
-        method = method or self.session.get
+        state = {}
+        root = None
+        for elem in self._iterQuery(path, method, kwargs, False, state):
+            if root is None:
+                root = elem
+
+        return root if state.get('complete') else None
+
+    def iterQuery(self, path, method=None, **kwargs):
+        """
+        Streaming version of query(). Yields the XML root as soon as its start tag
+        arrives, then each of its children as they complete, while the rest of the
+        response is still downloading. Yielded children are detached from the root,
+        unless the response goes into the response cache.
+        Returns a QueryStream, check its complete flag once it is exhausted to tell
+        a full response from one cut short by a timeout, error or cancel.
+        """
+        return QueryStream(self, path, method, kwargs)
+
+    def _iterQuery(self, path, method, kwargs, detach, state):
         url = self.buildUrl(path, includeToken=True)
 
         # If URL is empty, try refresh resources and return empty set for now
         if not url:
             util.WARN_LOG("Empty server url, returning None and refreshing resources")
             util.MANAGER.refreshResources(True)
-            return None
+            return
+
+        # Borrow a keep-alive session for this host unless the caller brought its own method
+        session = None
+        cacheKey = None
+        response = None
+        if not method:
+            cacheKey = http.RESPONSE_CACHE.getKey(url, kwargs.get('params'))
+            headers = dict(kwargs.get('headers') or {})
+            headers.update(http.RESPONSE_CACHE.getValidators(cacheKey))
+            kwargs['headers'] = headers
+            if asynctransport.TRANSPORT.isEnabled():
+                method = asynctransport.TRANSPORT.get
+            else:
+                session = http.SESSIONS.acquire(url)
+                method = session.get
+                kwargs['stream'] = True
 
         util.LOG('{0} {1}'.format(method.__name__.upper(), re.sub('X-Plex-Token=[^&]+', 'X-Plex-Token=****', url)))
         try:
             response = method(url, **kwargs)
-            if response.status_code not in (200, 201):
+            if response.status_code == 304 and cacheKey:
+                cached = http.RESPONSE_CACHE.get(cacheKey)
+                if cached is not None:
+                    state['complete'] = True
+                    yield cached
+                    for elem in list(cached):
+                        yield elem
+                    return
+            elif response.status_code not in (200, 201):
                 codename = http.status_codes.get(response.status_code, ['Unknown'])[0]
                 raise exceptions.BadRequest('({0}) {1}'.format(response.status_code, codename))
-            data = response.text.encode('utf8')
+            else:
+                # Parse while the body streams in, the session is only released after
+                cacheable = cacheKey and http.RESPONSE_CACHE.isCacheable(response)
+                reader = http.ContentReader(response)
+                root = None
+                for elem in http.iterXml(reader, detach=detach and not cacheable):
+                    if root is None:
+                        root = elem
+                    yield elem
+
+                state['complete'] = True
+                if cacheable and root is not None:
+                    http.RESPONSE_CACHE.store(cacheKey, response, root, reader.size)
+                return
         except asyncadapter.TimeoutException:
             util.ERROR()
             util.MANAGER.refreshResources(True)
-            return None
-        except http.requests.ConnectionError:
+            return
+        except (http.requests.ConnectionError, http.requests.exceptions.ChunkedEncodingError, http.requests.exceptions.ContentDecodingError):
             util.ERROR()
-            return None
+            return
         except asyncadapter.CanceledException:
-            return None
-
-        return ElementTree.fromstring(data) if data else None
+            return
+        finally:
+            if response is not None:
+                response.close()
+            if session:
+                http.SESSIONS.release(session)
+
+        # A 304 for an entry evicted since we sent the validators, fetch it again without them
+        headers = dict(kwargs['headers'])
+        headers.pop('If-None-Match', None)
+        headers.pop('If-Modified-Since', None)
+        kwargs['headers'] = headers
+        kwargs.pop('stream', None)
+        for elem in self._iterQuery(path, None, kwargs, detach, state):
+            yield elem
 
     def getImageTranscodeURL(self, path, width, height, **extraOpts):
         if not path:
@@ -287,6 +401,16 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         if self.rawVersion:
             self.versionNorm = util.normalizedVersion(self.rawVersion)
 
+        self.updateFeatures()
+
+        appMinVer = util.INTERFACE.getGlobal('minServerVersionArr', '0.0.0.0')
+        self.isSupported = self.isSecondary() or util.normalizedVersion(appMinVer) <= self.versionNorm
+
+        util.DEBUG_LOG("Server information updated from reachability check: {0}".format(self))
+
+        return True
+
+    def updateFeatures(self):
         features = {
             'mkvTranscode': '0.9.11.11',
             'themeTranscode': '0.9.14.0',
@@ -299,13 +423,6 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             if util.normalizedVersion(v) <= self.versionNorm:
                 self.features[f] = True
 
-        appMinVer = util.INTERFACE.getGlobal('minServerVersionArr', '0.0.0.0')
-        self.isSupported = self.isSecondary() or util.normalizedVersion(appMinVer) <= self.versionNorm
-
-        util.DEBUG_LOG("Server information updated from reachability check: {0}".format(self))
-
-        return True
-
     def updateReachability(self, force=True, allowFallback=False):
         if not force and self.activeConnection and self.activeConnection.state != plexresource.ResourceConnection.STATE_UNKNOWN:
             return
@@ -314,13 +431,12 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
 
         epoch = time.time()
         retrySeconds = 60
-        minSeconds = 10
         for i in range(len(self.connections)):
             conn = self.connections[i]
             diff = epoch - (conn.lastTestedAt or 0)
             if conn.hasPendingRequest:
                 util.DEBUG_LOG("Skip reachability test for {0} (has pending request)".format(conn))
-            elif diff < minSeconds or (not self.isSecondary() and self.isReachable() and diff < retrySeconds):
+            elif conn.isResultFresh(epoch) or (not self.isSecondary() and self.isReachable() and diff < retrySeconds):
                 util.DEBUG_LOG("Skip reachability test for {0} (checked {1} secs ago)".format(conn, diff))
             elif conn.testReachability(self, allowFallback):
                 self.pendingReachabilityRequests += 1
@@ -338,6 +454,35 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             conn = self.connections[i]
             conn.cancelReachability()
 
+    def getPendingPotentialScore(self):
+        best = 0
+        for i in range(len(self.connections)):
+            conn = self.connections[i]
+            if conn.hasPendingRequest:
+                best = max(best, conn.getPotentialScore())
+
+        return best
+
+    def abandonLosingReachability(self):
+        # Stop waiting on tests for connections that can't beat the active
+        # connection even if they do turn out to be reachable. Not while the
+        # active connection is itself being retested though, since it may be
+        # about to fail.
+        if self.activeConnection.hasPendingRequest:
+            return
+
+        score = self.activeConnection.getScore()
+        for i in range(len(self.connections)):
+            conn = self.connections[i]
+            if not conn.hasPendingRequest or conn.getPotentialScore() > score:
+                continue
+
+            util.DEBUG_LOG("Abandoning reachability test for {0}, {1} already won".format(conn.address, self.activeConnection.address))
+            conn.abandonReachability()
+            self.pendingReachabilityRequests -= 1
+            if conn.isSecure:
+                self.pendingSecureRequests -= 1
+
     def onReachabilityResult(self, connection):
         connection.lastTestedAt = time.time()
         connection.hasPendingRequest = None
@@ -362,11 +507,14 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
                 best = conn
 
         if best and best.state == best.STATE_REACHABLE:
-            if best.isSecure or self.pendingSecureRequests <= 0:
+            if best.isSecure or self.pendingSecureRequests <= 0 or best.getScore() >= self.getPendingPotentialScore():
                 self.activeConnection = best
             else:
                 util.DEBUG_LOG("Found a good connection for {0}, but holding out for better".format(repr(self.name)))
 
+        if self.activeConnection:
+            self.abandonLosingReachability()
+
         if self.pendingReachabilityRequests <= 0:
             # Retest the server with fallback enabled. hasFallback will only
             # be True if there are available insecure connections and fallback
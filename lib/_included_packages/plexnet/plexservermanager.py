@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import json
+import time
 
 from . import http
 from . import plexconnection
@@ -22,6 +23,10 @@ class SearchContext(dict):
 
 
 class PlexServerManager(signalsmixin.SignalsMixin):
+    # How old a saved last-known-good connection may be and still be used
+    # optimistically on startup
+    LAST_GOOD_MAX_AGE = 7 * 24 * 60 * 60
+
     def __init__(self):
         signalsmixin.SignalsMixin.__init__(self)
         # obj.Append(ListenersMixin())
@@ -30,6 +35,7 @@ class PlexServerManager(signalsmixin.SignalsMixin):
         self.transcodeServer = None
         self.channelServer = None
         self.deferReachabilityTimer = None
+        self.optimisticServer = None
 
         self.startSelectedServerSearch()
         self.loadState()
@@ -207,6 +213,11 @@ class PlexServerManager(signalsmixin.SignalsMixin):
         searching = not self.selectedServer and self.searchContext
 
         if reachable:
+            # Remember which connection worked for the selected server, so the
+            # next startup can use it right away.
+            if server == self.selectedServer and server.activeConnection.address != server.savedConnection:
+                self.saveState()
+
             # If we're in the middle of a search for our selected server, see if
             # this is a candidate.
             self.trigger('reachable:server', server=server)
@@ -320,10 +331,12 @@ class PlexServerManager(signalsmixin.SignalsMixin):
             util.ERROR_LOG("Failed to parse PlexServerManager JSON")
             return
 
+        optimisticServer = None
         for serverObj in obj['servers']:
             server = plexserver.createPlexServerForName(serverObj['uuid'], serverObj['name'])
             server.owned = bool(serverObj.get('owned'))
             server.sameNetwork = serverObj.get('sameNetwork')
+            lastGood = serverObj.get('lastGood')
 
             hasSecureConn = False
             for i in range(len(serverObj.get('connections', []))):
@@ -344,11 +357,51 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                 else:
                     server.connections.append(connection)
 
+                if lastGood and lastGood.get('address') == connection.address:
+                    connection.rtt = lastGood.get('rtt')
+                    connection.lastReachableAt = lastGood.get('at') or 0
+                    if server.uuid == self.searchContext.preferredServer and self.isLastGoodUsable(lastGood):
+                        self.restoreLastGood(server, connection, lastGood)
+                        optimisticServer = server
+
             self.serversByUuid[server.uuid] = server
 
         util.LOG("Loaded {0} servers from registry".format(len(obj['servers'])))
+
+        # Selected by selectOptimisticServer() once plexapp.init() has wired up its listeners
+        self.optimisticServer = optimisticServer
+
         self.updateReachability(False, True)
 
+    def selectOptimisticServer(self):
+        # Use the connection that worked last time right away, and check it
+        # in the background. A failed check deselects the server and the
+        # normal search carries on from there.
+        server = self.optimisticServer
+        self.optimisticServer = None
+        if not server or self.selectedServer or self.serversByUuid.get(server.uuid) is not server:
+            return
+
+        util.LOG("Optimistically selecting {0} using {1}".format(repr(server.name), server.activeConnection.address))
+        if self.setSelectedServer(server, True):
+            server.updateReachability(True)
+
+    def isLastGoodUsable(self, lastGood):
+        return time.time() - (lastGood.get('at') or 0) < self.LAST_GOOD_MAX_AGE
+
+    def restoreLastGood(self, server, connection, lastGood):
+        connection.state = connection.STATE_REACHABLE
+        connection.getScore(True)
+        server.activeConnection = connection
+        server.savedConnection = connection.address
+        server.serverClass = lastGood.get('serverClass')
+        server.rawVersion = lastGood.get('version')
+        if server.rawVersion:
+            server.versionNorm = util.normalizedVersion(server.rawVersion)
+            server.updateFeatures()
+
+        server.isSupported = lastGood.get('isSupported')
+
     def saveState(self):
         # Serialize our important information to JSON and save it to the registry.
         # We'll always update server info upon connecting, so we don't need much
@@ -380,6 +433,17 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                         'token': conn.token
                     })
 
+                if server.isReachable():
+                    serverObj['lastGood'] = {
+                        'address': server.activeConnection.address,
+                        'rtt': server.activeConnection.rtt,
+                        'at': server.activeConnection.lastReachableAt,
+                        'version': server.rawVersion,
+                        'serverClass': server.serverClass,
+                        'isSupported': server.isSupported
+                    }
+                    server.savedConnection = server.activeConnection.address
+
                 obj['servers'].append(serverObj)
 
         if self.selectedServer and not self.selectedServer.synced and not self.selectedServer.isSecondary():
@@ -0,0 +1,177 @@
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+from . import threadutils
+from . import util
+
+
+class RequestLane(object):
+    def __init__(self, name, priority, maxActive, maxQueued):
+        self.name = name
+        self.priority = priority
+        self.maxActive = maxActive
+        self.maxQueued = maxQueued
+        self.queue = collections.deque()
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return '<RequestLane:{0} queued={1} active={2}>'.format(self.name, len(self.queue), self.active)
+
+    def canStart(self):
+        return self.queue and self.active < self.maxActive
+
+
+class RequestExecutor(object):
+    """
+    Runs HttpRequest.startAsync() requests on a bounded pool of worker threads
+    instead of a new thread per request.
+
+    Requests are queued in lanes picked from their context's requestType. Lanes
+    are served in priority order, each with its own concurrency limit. A lane
+    with a queue limit rejects new requests when full instead of queueing
+    without bound.
+    Workers are started on demand and exit after IDLE_TIMEOUT seconds without work.
+    """
+    MAX_WORKERS = 8
+    IDLE_TIMEOUT = 30
+
+    LANE_BY_REQUEST_TYPE = {
+        'reachability': 'reachability',
+        'manual_connections': 'reachability',
+        'timelineUpdate': 'timeline'
+    }
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lanes = {}
+        self._lanesByPriority = []
+        self._workers = 0
+        self._idle = 0
+        self._workerID = 0
+        self._shutdown = False
+
+        self.addLane('reachability', 0, maxActive=6, maxQueued=64)
+        self.addLane('timeline', 1, maxActive=2, maxQueued=8)
+        # Untagged requests never had a limit, so they may use every worker and are never rejected
+        self.addLane('default', 2, maxActive=self.MAX_WORKERS, maxQueued=None)
+
+    def addLane(self, name, priority, maxActive, maxQueued):
+        lane = RequestLane(name, priority, maxActive, maxQueued)
+        with self._cond:
+            self._lanes[name] = lane
+            self._lanesByPriority = sorted(self._lanes.values(), key=lambda l: l.priority)
+        return lane
+
+    def getLane(self, context):
+        requestType = context and context.requestType
+        return self._lanes[self.LANE_BY_REQUEST_TYPE.get(requestType, 'default')]
+
+    def submit(self, request, force=False, **kwargs):
+        lane = self.getLane(kwargs.get('context'))
+        with self._cond:
+            if self._shutdown:
+                return False
+
+            if lane.maxQueued is not None and len(lane.queue) >= lane.maxQueued and not force:
+                lane.rejected += 1
+                util.WARN_LOG('Request lane {0} is full, rejecting: {1}'.format(lane.name, util.cleanToken(request.url)))
+                return False
+
+            lane.queue.append((request, kwargs))
+            lane.submitted += 1
+
+            if self._idle:
+                self._cond.notify()
+
+            # Idle workers may already have been woken by earlier submits, so only
+            # count on them for as much work as there is room to start right now
+            if self._workers < self.MAX_WORKERS and self._getStartable() > self._idle:
+                self._startWorker()
+
+        return True
+
+    def discard(self, request):
+        # Drop a request that was canceled before a worker got to it
+        with self._cond:
+            for lane in self._lanesByPriority:
+                for item in lane.queue:
+                    if item[0] is request:
+                        lane.queue.remove(item)
+                        return True
+
+        return False
+
+    def _startWorker(self):
+        self._workers += 1
+        self._workerID += 1
+        thread = threadutils.KillableThread(target=self._workerLoop, name='HTTP-ASYNC-WORKER({0})'.format(self._workerID))
+        thread.start()
+
+    def _getStartable(self):
+        return sum(min(len(lane.queue), max(0, lane.maxActive - lane.active)) for lane in self._lanesByPriority)
+
+    def _next(self):
+        for lane in self._lanesByPriority:
+            if lane.canStart():
+                lane.active += 1
+                return lane, lane.queue.popleft()
+
+        return None
+
+    def _workerLoop(self):
+        while True:
+            with self._cond:
+                item = self._next()
+                while item is None:
+                    if self._shutdown:
+                        self._workers -= 1
+                        return
+
+                    self._idle += 1
+                    waitStart = time.time()
+                    self._cond.wait(self.IDLE_TIMEOUT)
+                    self._idle -= 1
+
+                    item = self._next()
+                    if item is None and time.time() - waitStart >= self.IDLE_TIMEOUT:
+                        self._workers -= 1
+                        return
+
+            lane, (request, kwargs) = item
+            try:
+                request._startAsync(**kwargs)
+            except:
+                util.ERROR()
+            finally:
+                with self._cond:
+                    lane.active -= 1
+
+    def getMetrics(self):
+        with self._cond:
+            return {
+                'threads': self._workers,
+                'idle': self._idle,
+                'queued': sum(len(lane.queue) for lane in self._lanesByPriority),
+                'lanes': dict(
+                    (lane.name, {
+                        'queued': len(lane.queue),
+                        'active': lane.active,
+                        'submitted': lane.submitted,
+                        'rejected': lane.rejected
+                    }) for lane in self._lanesByPriority
+                )
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            for lane in self._lanesByPriority:
+                lane.queue.clear()
+            self._cond.notify_all()
+
+
+EXECUTOR = RequestExecutor()
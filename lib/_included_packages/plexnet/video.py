@@ -95,11 +95,13 @@ class Video(media.MediaItem):
     def markWatched(self, **kwargs):
         path = '/:/scrobble?key=%s&identifier=com.plexapp.plugins.library' % self.ratingKey
         self.server.query(path)
+        self.invalidateCache()
         self.reload(**kwargs)
 
     def markUnwatched(self, **kwargs):
         path = '/:/unscrobble?key=%s&identifier=com.plexapp.plugins.library' % self.ratingKey
         self.server.query(path)
+        self.invalidateCache()
         self.reload(**kwargs)
 
     # def play(self, client):
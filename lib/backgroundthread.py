@@ -1,32 +1,169 @@
 from __future__ import absolute_import
 import six.moves.queue
+import collections
 import heapq
+import json
+import os
+import threading
+import time
 from kodi_six import xbmc
 from . import util
 from plexnet import threadutils
 from six.moves import range
 
+MIN_WORKERS = 2
+MAX_WORKERS = 8
+WORKER_IDLE_TIMEOUT = 30  # Seconds a worker above MIN_WORKERS waits for a task before exiting
+WORKER_POLL_INTERVAL = 0.5  # How often idle workers check for abort
+SERVER_MAX_TASKS = 4  # Tasks for one server that may run at once, so a slow server can't hold every worker
+
+INTERACTIVE = 'interactive'  # The user is waiting on the result (visible chunks, focused hub)
+SPECULATIVE = 'speculative'  # Prefetches, reloads and refreshes
+TASK_CLASS_WEIGHTS = {INTERACTIVE: 4, SPECULATIVE: 1}
+
+SLOW_TASK_TIME = 2.0  # Tasks that take longer than this from queueing to finish go in the slow task log
+SLOW_TASK_LOG_SIZE = 50
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class TaskStats(object):
+    """
+    Timings for every task that goes through the BackgroundThreader: per task
+    type counts, wait and run times, cancellations by reason, a histogram of
+    queue depth at enqueue time and a rolling log of slow tasks. With the
+    debug_tasks setting on, slow tasks are logged as they finish and the
+    whole thing is written to task_stats.json in the profile on shutdown.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.types = {}
+            self.depths = [0] * len(QUEUE_DEPTH_BUCKETS)
+            self.slow = collections.deque(maxlen=SLOW_TASK_LOG_SIZE)
+            self.since = time.time()
+
+    def _type(self, task):
+        name = task.__class__.__name__
+        stats = self.types.get(name)
+        if stats is None:
+            stats = self.types[name] = {
+                'queued': 0, 'finished': 0, 'errors': 0, 'cancelled': {},
+                'wait': 0.0, 'run': 0.0, 'maxWait': 0.0, 'maxRun': 0.0
+            }
+        return stats
+
+    def queued(self, task, depth):
+        task._queuedAt = time.time()
+        task._startedAt = None
+        bucket = 0
+        while bucket < len(QUEUE_DEPTH_BUCKETS) - 1 and depth >= QUEUE_DEPTH_BUCKETS[bucket + 1]:
+            bucket += 1
+
+        with self._lock:
+            self._type(task)['queued'] += 1
+            self.depths[bucket] += 1
+
+    def started(self, task):
+        task._startedAt = time.time()
+
+    def finished(self, task, error=False):
+        now = time.time()
+        queuedAt = getattr(task, '_queuedAt', None) or now
+        startedAt = getattr(task, '_startedAt', None)
+        wait = (startedAt or now) - queuedAt
+        run = startedAt and now - startedAt or 0.0
+        reason = task._canceled and (task._cancelReason or 'cancelled') or None
+
+        with self._lock:
+            stats = self._type(task)
+            if reason:
+                stats['cancelled'][reason] = stats['cancelled'].get(reason, 0) + 1
+            else:
+                stats['finished'] += 1
+            if error:
+                stats['errors'] += 1
+            stats['wait'] += wait
+            stats['run'] += run
+            stats['maxWait'] = max(stats['maxWait'], wait)
+            stats['maxRun'] = max(stats['maxRun'], run)
+
+            if wait + run < SLOW_TASK_TIME:
+                return
+
+            record = {
+                'task': task.__class__.__name__,
+                'description': task.describe(),
+                'class': task.taskClass,
+                'server': task._lane and task._lane[0],
+                'queued': queuedAt,
+                'started': startedAt,
+                'finished': now,
+                'wait': wait,
+                'run': run,
+                'cancelled': reason
+            }
+            self.slow.append(record)
+
+        if util.advancedSettings.debugTasks:
+            util.LOG('BGThreader: slow task {0}({1}): waited {2:.2f}s, ran {3:.2f}s{4}'.format(
+                record['task'], record['description'], wait, run, reason and ' ({0})'.format(reason) or ''
+            ))
+
+    def toDict(self):
+        with self._lock:
+            return {
+                'since': self.since,
+                'now': time.time(),
+                'types': dict((name, dict(stats, cancelled=dict(stats['cancelled']))) for name, stats in self.types.items()),
+                'queueDepth': dict(('{0}+'.format(b), c) for b, c in zip(QUEUE_DEPTH_BUCKETS, self.depths)),
+                'slow': list(self.slow)
+            }
+
+    def dump(self, path=None):
+        path = path or os.path.join(util.PROFILE, 'task_stats.json')
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.toDict(), f, indent=1, sort_keys=True)
+        except Exception:
+            util.ERROR('Failed to write task stats')
+            return None
+        return path
+
+
+TASK_STATS = TaskStats()
+
 
 class Tasks(list):
     def add(self, task):
-        for t in self:
-            if not t.isValid():
-                self.remove(t)
+        self[:] = [t for t in self if t.isValid()]
 
         if isinstance(task, list):
             self += task
         else:
             self.append(task)
 
-    def cancel(self):
+    def cancel(self, reason='owner'):
         while self:
-            self.pop().cancel()
+            self.pop().cancel(reason)
+
+    def moveToFront(self):
+        self[:] = [t for t in self if t.isValid()]
+        BGThreader.moveTasksToFront(self)
 
 
 class Task:
+    taskClass = INTERACTIVE
+
     def __init__(self, priority=None):
         self._priority = priority
         self._canceled = False
+        self._cancelReason = None
+        self._queueIndex = None
+        self._queueOrder = 0
+        self._lane = None
         self.finished = False
 
     def __cmp__(self, other):
@@ -48,7 +185,17 @@ class Task:
     def run(self):
         pass
 
-    def cancel(self):
+    def getServer(self):
+        """The server this task makes requests to, if any. Used to limit concurrent tasks per server."""
+        return None
+
+    def describe(self):
+        """Short description of what this task is for, used in the slow task log."""
+        return ''
+
+    def cancel(self, reason=None):
+        if not self._canceled:
+            self._cancelReason = reason
         self._canceled = True
 
     def isCanceled(self):
@@ -58,27 +205,250 @@ class Task:
         return not self.finished and not self._canceled
 
 
-class MutablePriorityQueue(six.moves.queue.PriorityQueue):
-    def _get(self, heappop=heapq.heappop):
-            self.queue.sort()
-            return heappop(self.queue)
+class TaskHeap(object):
+    """
+    Binary heap of tasks ordered by (_priority, insertion order) that tracks
+    each task's index in the heap, so push, pop and update are O(log n).
+    """
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def _key(self, task):
+        return (task._priority, task._queueOrder)
+
+    def peek(self):
+        return self.heap[0]
+
+    def push(self, task):
+        task._queueIndex = len(self.heap)
+        self.heap.append(task)
+        self._siftUp(task._queueIndex)
+
+    def pop(self):
+        heap = self.heap
+        task = heap[0]
+        last = heap.pop()
+        if heap:
+            heap[0] = last
+            last._queueIndex = 0
+            self._siftDown(0)
+        task._queueIndex = None
+        return task
+
+    def contains(self, task):
+        idx = task._queueIndex
+        return idx is not None and idx < len(self.heap) and self.heap[idx] is task
+
+    def update(self, task, oldPriority):
+        if task._priority < oldPriority:
+            self._siftUp(task._queueIndex)
+        else:
+            self._siftDown(task._queueIndex)
+
+    def _siftUp(self, idx):
+        heap = self.heap
+        task = heap[idx]
+        key = self._key(task)
+        while idx > 0:
+            parentIdx = (idx - 1) >> 1
+            parent = heap[parentIdx]
+            if key >= self._key(parent):
+                break
+            heap[idx] = parent
+            parent._queueIndex = idx
+            idx = parentIdx
+        heap[idx] = task
+        task._queueIndex = idx
+
+    def _siftDown(self, idx):
+        heap = self.heap
+        size = len(heap)
+        task = heap[idx]
+        key = self._key(task)
+        while True:
+            childIdx = 2 * idx + 1
+            if childIdx >= size:
+                break
+            rightIdx = childIdx + 1
+            if rightIdx < size and self._key(heap[rightIdx]) < self._key(heap[childIdx]):
+                childIdx = rightIdx
+            child = heap[childIdx]
+            if key <= self._key(child):
+                break
+            heap[idx] = child
+            child._queueIndex = idx
+            idx = childIdx
+        heap[idx] = task
+        task._queueIndex = idx
+
+
+class MutablePriorityQueue(six.moves.queue.Queue):
+    """
+    Task queue with one TaskHeap per (server, task class) lane.
+
+    get() only considers lanes whose server is running fewer than
+    SERVER_MAX_TASKS tasks, and shares workers between task classes by
+    weighted fair queuing on TASK_CLASS_WEIGHTS. Within a class the task with
+    the lowest priority value goes first. Cancelled tasks, and tasks queued
+    before the last newGeneration(), are dropped when they reach the top of
+    their lane. Workers must call taskDone() for every task they get.
+    """
+    def _init(self, maxsize):
+        self._lanes = {}
+        self._running = {}
+        self._virtualTime = dict((c, 0.0) for c in TASK_CLASS_WEIGHTS)
+        self._waits = dict((c, [0, 0.0, 0.0]) for c in TASK_CLASS_WEIGHTS)
+        self._counter = 0
+        self.generation = 0
+
+    def _serverOpen(self, serverKey):
+        return serverKey is None or self._running.get(serverKey, 0) < SERVER_MAX_TASKS
+
+    def _qsize(self, len=len):
+        # Only what a worker could start right now
+        return sum(len(lane) for (serverKey, taskClass), lane in self._lanes.items() if self._serverOpen(serverKey))
+
+    def pending(self):
+        with self.mutex:
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def _put(self, task):
+        self._counter += 1
+        task._queueOrder = self._counter
+        task._generation = self.generation
+        TASK_STATS.queued(task, sum(len(lane) for lane in self._lanes.values()))
+
+        server = task.getServer()
+        taskClass = task.taskClass in TASK_CLASS_WEIGHTS and task.taskClass or INTERACTIVE
+        laneKey = (server and server.uuid or None, taskClass)
+        if not self._lanes:
+            # Nothing is queued, so no class is owed time from before
+            self._virtualTime = dict((c, 0.0) for c in TASK_CLASS_WEIGHTS)
+        elif not any(k[1] == taskClass for k in self._lanes):
+            # An idle class doesn't get to catch up on the time it wasn't queuing
+            active = [self._virtualTime[k[1]] for k in self._lanes]
+            if active:
+                self._virtualTime[taskClass] = max(self._virtualTime[taskClass], min(active))
+
+        lane = self._lanes.get(laneKey)
+        if lane is None:
+            lane = self._lanes[laneKey] = TaskHeap()
+        task._lane = laneKey
+        lane.push(task)
+
+    def _nextLane(self):
+        best = None
+        for laneKey, lane in self._lanes.items():
+            if not self._serverOpen(laneKey[0]):
+                continue
+            rank = (self._virtualTime[laneKey[1]], lane._key(lane.peek()))
+            if best is None or rank < best[0]:
+                best = (rank, laneKey)
+        return best and best[1]
+
+    def _get(self):
+        while True:
+            laneKey = self._nextLane()
+            lane = self._lanes[laneKey]
+            task = lane.pop()
+            if not lane:
+                del self._lanes[laneKey]
+
+            if self._dropped(task) and self._qsize():
+                # Dropped without being handed to a worker, so account for it here
+                self.unfinished_tasks -= 1
+                TASK_STATS.finished(task)
+                continue
+
+            serverKey, taskClass = laneKey
+            if serverKey is not None:
+                self._running[serverKey] = self._running.get(serverKey, 0) + 1
+            self._virtualTime[taskClass] += 1.0 / TASK_CLASS_WEIGHTS[taskClass]
+
+            wait = time.time() - task._queuedAt
+            stats = self._waits[taskClass]
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] = max(stats[2], wait)
+            return task
+
+    def _dropped(self, task):
+        if task._generation != self.generation:
+            task.cancel('reset')
+        return task._canceled
+
+    def taskDone(self, task):
+        serverKey = task._lane and task._lane[0]
+        with self.mutex:
+            if serverKey is not None:
+                self._running[serverKey] -= 1
+                if not self._running[serverKey]:
+                    del self._running[serverKey]
+                # Tasks for this server may be runnable again
+                self.not_empty.notify()
+        self.task_done()
+
+    def _find(self, task):
+        lane = self._lanes.get(task._lane)
+        if lane is not None and lane.contains(task):
+            return lane
+
+    def _lowest(self):
+        lowest = None
+        for lane in self._lanes.values():
+            task = lane.peek()
+            if lowest is None or task._priority < lowest._priority:
+                lowest = task
+        return lowest
+
+    def newGeneration(self):
+        with self.mutex:
+            self.generation += 1
 
     def lowest(self):
-        """Return the lowest priority item in the queue (not reliable!)."""
-        self.mutex.acquire()
-        try:
-            lowest = self.queue and min(self.queue) or None
-        except:
-            lowest = None
-            util.ERROR()
-        finally:
-            self.mutex.release()
-        return lowest
+        """Return the queued item with the lowest priority value."""
+        with self.mutex:
+            return self._lowest()
+
+    def reprioritize(self, task, priority):
+        with self.mutex:
+            old = task._priority
+            task._priority = priority
+            lane = self._find(task)
+            if lane is None:
+                return False
+
+            lane.update(task, old)
+            return True
+
+    def moveToFront(self, tasks):
+        # Keeps the relative order of tasks ahead of everything already queued
+        with self.mutex:
+            lowest = self._lowest()
+            p = (lowest and lowest._priority or 0) - len(tasks)
+            for task in tasks:
+                old = task._priority
+                task._priority = p
+                p += 1
+                lane = self._find(task)
+                if lane is not None:
+                    lane.update(task, old)
+
+    def waitStats(self):
+        """Return {task class: (tasks started, average wait, longest wait)} in seconds."""
+        with self.mutex:
+            return dict(
+                (c, (count, count and total / count or 0.0, longest)) for c, (count, total, longest) in self._waits.items()
+            )
 
 
 class BackgroundWorker:
-    def __init__(self, queue, name=None):
-        self._queue = queue
+    def __init__(self, threader, name=None):
+        self._threader = threader
+        self._queue = threader._queue
         self.name = name
         self._thread = None
         self._abort = False
@@ -86,11 +456,17 @@ class BackgroundWorker:
 
     def _runTask(self, task):
         if task._canceled:
+            TASK_STATS.finished(task)
             return
+
+        TASK_STATS.started(task)
         try:
             task._run()
         except:
             util.ERROR()
+            TASK_STATS.finished(task, error=True)
+        else:
+            TASK_STATS.finished(task)
 
     def abort(self):
         self._abort = True
@@ -107,24 +483,35 @@ class BackgroundWorker:
         self._thread.start()
 
     def _queueLoop(self):
-        if self._queue.empty():
-            return
-
-        util.DEBUG_LOG('BGThreader: ({0}): Active'.format(self.name))
+        util.DEBUG_LOG('BGThreader: ({0}): Started'.format(self.name))
+        idleSince = time.time()
         try:
             while not self.aborted():
-                self._task = self._queue.get_nowait()
-                self._runTask(self._task)
-                self._queue.task_done()
-                self._task = None
-        except six.moves.queue.Empty:
-            util.DEBUG_LOG('BGThreader ({0}): Idle'.format(self.name))
+                try:
+                    task = self._queue.get(timeout=WORKER_POLL_INTERVAL)
+                except six.moves.queue.Empty:
+                    if time.time() - idleSince >= WORKER_IDLE_TIMEOUT and self._threader.retireWorker(self):
+                        break
+                    continue
+
+                self._threader.workerBusy(True)
+                self._task = task
+                try:
+                    self._runTask(task)
+                finally:
+                    self._task = None
+                    self._queue.taskDone(task)
+                    self._threader.workerBusy(False)
+                idleSince = time.time()
+        finally:
+            self._threader.retireWorker(self, force=True)
+            util.DEBUG_LOG('BGThreader: ({0}): Stopped'.format(self.name))
 
     def shutdown(self):
         self.abort()
 
         if self._task:
-            self._task.cancel()
+            self._task.cancel('shutdown')
 
         if self._thread and self._thread.isAlive():
             util.DEBUG_LOG('BGThreader: thread ({0}): Waiting...'.format(self.name))
@@ -132,16 +519,21 @@ class BackgroundWorker:
             util.DEBUG_LOG('BGThreader: thread ({0}): Done'.format(self.name))
 
     def working(self):
-        return self._thread and self._thread.isAlive()
+        return self._task is not None
 
 
 class BackgroundThreader:
-    def __init__(self, name=None, worker_count=8):
+    def __init__(self, name=None, worker_count=MAX_WORKERS, min_workers=MIN_WORKERS):
         self.name = name
+        self.maxWorkers = worker_count
+        self.minWorkers = min(min_workers, worker_count)
         self._queue = MutablePriorityQueue()
         self._abort = False
         self._priority = -1
-        self.workers = [BackgroundWorker(self._queue, 'queue.{0}:worker.{1}'.format(self.name, x)) for x in range(worker_count)]
+        self._workerLock = threading.Lock()
+        self._workerIndex = 0
+        self._busy = 0
+        self.workers = []
 
     def _nextPriority(self):
         self._priority += 1
@@ -149,7 +541,10 @@ class BackgroundThreader:
 
     def abort(self):
         self._abort = True
-        for w in self.workers:
+        with self._workerLock:
+            workers = list(self.workers)
+
+        for w in workers:
             w.abort()
         return self
 
@@ -158,10 +553,28 @@ class BackgroundThreader:
 
     def shutdown(self):
         self.abort()
+        self.logWaitStats()
+        if util.advancedSettings.debugTasks:
+            TASK_STATS.dump()
 
-        for w in self.workers:
+        with self._workerLock:
+            workers = list(self.workers)
+
+        for w in workers:
             w.shutdown()
 
+    def reset(self):
+        # Tasks queued so far are dropped as workers reach them, running tasks are left to finish
+        self._queue.newGeneration()
+        self.logWaitStats()
+
+    def logWaitStats(self):
+        for taskClass, (count, average, longest) in sorted(self._queue.waitStats().items()):
+            if count:
+                util.DEBUG_LOG('BGThreader: {0} tasks: {1} started, queue wait avg {2:.0f}ms, max {3:.0f}ms'.format(
+                    taskClass, count, average * 1000, longest * 1000
+                ))
+
     def addTask(self, task):
         task._priority = self._nextPriority()
         self._queue.put(task)
@@ -188,11 +601,42 @@ class BackgroundThreader:
         self.startWorkers()
 
     def startWorkers(self):
-        for w in self.workers:
+        if self.aborted():
+            return
+
+        with self._workerLock:
+            idle = len(self.workers) - self._busy
+            wanted = min(self.maxWorkers, max(self.minWorkers, self._busy + self._queue.qsize()))
+            if idle >= self._queue.qsize() and len(self.workers) >= self.minWorkers:
+                return
+
+            new = []
+            while len(self.workers) < wanted:
+                self._workerIndex += 1
+                w = BackgroundWorker(self, 'queue.{0}:worker.{1}'.format(self.name, self._workerIndex))
+                self.workers.append(w)
+                new.append(w)
+
+        for w in new:
             w.start()
 
+    def retireWorker(self, worker, force=False):
+        with self._workerLock:
+            if worker not in self.workers:
+                return True
+
+            if not force and len(self.workers) <= self.minWorkers:
+                return False
+
+            self.workers.remove(worker)
+            return True
+
+    def workerBusy(self, busy):
+        with self._workerLock:
+            self._busy += busy and 1 or -1
+
     def working(self):
-        return not self._queue.empty() or self.hasTask()
+        return bool(self._queue.pending()) or self.hasTask()
 
     def hasTask(self):
         return any([w.working() for w in self.workers])
@@ -209,30 +653,24 @@ class BackgroundThreader:
         if lowest is None:
             return
 
-        qitem._priority = lowest - 1
+        self._queue.reprioritize(qitem, lowest - 1)
+
+    def moveTasksToFront(self, tasks):
+        self._queue.moveToFront(tasks)
 
 
 class ThreaderManager:
     def __init__(self):
-        self.index = 0
-        self.abandoned = []
-        self.threader = BackgroundThreader(str(self.index))
+        self.threader = BackgroundThreader('0')
 
     def __getattr__(self, name):
         return getattr(self.threader, name)
 
     def reset(self):
-        if self.threader._queue.empty() and not self.threader.hasTask():
-            return
-
-        self.index += 1
-        self.abandoned.append(self.threader.abort())
-        self.threader = BackgroundThreader(str(self.index))
+        self.threader.reset()
 
     def shutdown(self):
         self.threader.shutdown()
-        for a in self.abandoned:
-            a.shutdown()
 
 
 BGThreader = ThreaderManager()
@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+import collections
+import math
+import threading
+
+CHUNK_CACHE_SIZE = 12  # Fetched chunks kept in memory for scrolling back to them
+MAX_PREFETCH_CHUNKS = 3
+
+
+class ChunkCache(object):
+    """
+    Fetched chunk mode chunks in LRU order, so scrolling back to a chunk that
+    has left the three chunk window doesn't fetch it again. Also keeps a moving
+    average of how long a chunk takes to fetch and parse, which decides how far
+    ahead LibraryWindow prefetches.
+    """
+    def __init__(self, size=CHUNK_CACHE_SIZE):
+        self.size = size
+        self.fetchTime = 1.0
+        self._lock = threading.Lock()
+        self._chunks = collections.OrderedDict()
+        self._pending = {}
+
+    def get(self, key):
+        with self._lock:
+            items = self._chunks.pop(key, None)
+            if items is None:
+                return None
+
+            self._chunks[key] = items
+            return list(items)
+
+    def startFetch(self, key):
+        # Returns None if the caller should fetch the chunk, otherwise an event
+        # that is set when the fetch already in progress is done
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+
+            self._pending[key] = threading.Event()
+
+    def endFetch(self, key, items=None, fetchTime=None):
+        with self._lock:
+            if items is not None:
+                self._chunks.pop(key, None)
+                self._chunks[key] = list(items)
+                while len(self._chunks) > self.size:
+                    self._chunks.popitem(last=False)
+
+                self.fetchTime = self.fetchTime * 0.7 + fetchTime * 0.3
+
+            event = self._pending.pop(key, None)
+
+        if event:
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+
+    def getPrefetchCount(self, scrollVelocity, chunkSize):
+        # Enough chunks to cover the distance scrolled (items per second) while one chunk is being fetched
+        ahead = int(math.ceil(scrollVelocity * self.fetchTime / chunkSize))
+        return min(MAX_PREFETCH_CHUNKS, max(1, ahead))
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+
+from plexnet import plexapp, callback
+
+from . import util
+
+CACHE_PATH = os.path.join(util.PROFILE, 'hubs')
+CACHE_VERSION = 1
+CACHE_MAX_AGE = 604800  # A week. Older hubs are more likely to be wrong than helpful, even for a first paint
+
+
+class HubCache(object):
+    """
+    Last known hubs per server, user and section, kept on disk so the home
+    screen can be drawn from them on launch while they are fetched again.
+    Entries are the plexobjects.packElement() data from PlexServer.hubs().
+    Everything is removed when the user changes or signs out.
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        plexapp.util.APP.on('change:user', callback.Callable(self.onAccountChange))
+
+    def _getFilePath(self, server, section):
+        key = '{0}:{1}:{2}'.format(server.uuid, plexapp.ACCOUNT.ID, section or '')
+        return os.path.join(self.path, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def get(self, server, section):
+        path = self._getFilePath(server, section)
+        try:
+            with open(path, 'rb') as f:
+                version, created, packed = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (IOError, OSError):
+            return None
+        except Exception:
+            util.ERROR('Failed to read cached hubs')
+            return None
+
+        if version != CACHE_VERSION or time.time() - created > CACHE_MAX_AGE:
+            return None
+
+        return packed
+
+    def put(self, server, section, packed):
+        if not packed:
+            return
+
+        path = self._getFilePath(server, section)
+        data = zlib.compress(json.dumps([CACHE_VERSION, int(time.time()), packed], separators=(',', ':')).encode('utf-8'))
+        tmp = path + '.tmp'
+        with self._lock:
+            try:
+                if not os.path.exists(self.path):
+                    os.makedirs(self.path)
+
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp, path)
+            except (IOError, OSError):
+                util.ERROR('Failed to write cached hubs')
+
+    def clear(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+
+            util.DEBUG_LOG('Clearing hub cache')
+            for name in os.listdir(self.path):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except (IOError, OSError):
+                    util.ERROR('Failed to remove cached hubs')
+
+    def onAccountChange(self, account, reallyChanged=False):
+        if reallyChanged:
+            self.clear()
+
+
+HUB_CACHE = HubCache()
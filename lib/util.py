@@ -91,6 +91,7 @@ class AdvancedSettings(object):
 
     _proxiedSettings = (
         ("debug", False),
+        ("debug_tasks", False),
         ("kodi_skip_stepping", False),
         ("auto_seek", True),
         ("dynamic_timeline_seek", False),
@@ -9,7 +9,7 @@ from lib import backgroundthread
 from lib import metadata
 from lib import player
 
-from plexnet import plexapp, playlist, plexplayer
+from plexnet import plexapp, playlist, plexplayer, plexobjects
 
 from . import busy
 from . import videoplayer
@@ -27,11 +27,19 @@ from six.moves import range
 
 
 class EpisodeReloadTask(backgroundthread.Task):
-    def setup(self, episode, callback):
-        self.episode = episode
+    taskClass = backgroundthread.SPECULATIVE
+
+    def setup(self, episodes, callback):
+        self.episodes = episodes
         self.callback = callback
         return self
 
+    def getServer(self):
+        return self.episodes[0].server
+
+    def describe(self):
+        return ','.join(str(e.ratingKey) for e in self.episodes)
+
     def run(self):
         if self.isCanceled():
             return
@@ -41,13 +49,19 @@ class EpisodeReloadTask(backgroundthread.Task):
             return
 
         try:
-            self.episode.reload(checkFiles=1)
-            if self.isCanceled():
-                return
-            self.callback(self.episode)
+            plexobjects.reloadMany(self.episodes, checkFiles=1)
         except:
             util.ERROR()
 
+        # Episodes that failed to reload still get their callback, with the data they already had
+        for episode in self.episodes:
+            if self.isCanceled():
+                return
+            try:
+                self.callback(episode)
+            except:
+                util.ERROR()
+
 
 class EpisodesWindow(kodigui.ControlledWindow, windowutils.UtilMixin):
     xmlFile = 'script-plex-episodes.xml'
@@ -805,8 +819,9 @@ class EpisodesWindow(kodigui.ControlledWindow, windowutils.UtilMixin):
 
     def reloadItems(self, items):
         tasks = []
-        for mli in items:
-            task = EpisodeReloadTask().setup(mli.dataSource, self.reloadItemCallback)
+        episodes = [mli.dataSource for mli in items]
+        for start in range(0, len(episodes), plexobjects.RELOAD_BATCH_SIZE):
+            task = EpisodeReloadTask().setup(episodes[start:start + plexobjects.RELOAD_BATCH_SIZE], self.reloadItemCallback)
             self.tasks.add(task)
             tasks.append(task)
 
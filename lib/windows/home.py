@@ -11,6 +11,7 @@ from lib import util
 from lib import backgroundthread
 from lib import colors
 from lib import player
+from lib import hubcache
 
 import plexnet
 from plexnet import plexapp
@@ -47,8 +48,11 @@ MOVE_SET = frozenset(
 
 
 class HubsList(list):
-    def init(self):
+    def init(self, packed=None, cached=False):
         self.lastUpdated = time.time()
+        # Packed hub elements, in the same order as the hubs. Compared to tell which hubs changed.
+        self.packed = packed and packed[1:] or None
+        self.cached = cached
         return self
 
 
@@ -58,6 +62,12 @@ class SectionHubsTask(backgroundthread.Task):
         self.callback = callback
         return self
 
+    def getServer(self):
+        return plexapp.SERVERMANAGER.selectedServer
+
+    def describe(self):
+        return self.section.key or self.section.type
+
     def run(self):
         if self.isCanceled():
             return
@@ -67,7 +77,10 @@ class SectionHubsTask(backgroundthread.Task):
             return
 
         try:
-            hubs = HubsList(plexapp.SERVERMANAGER.selectedServer.hubs(self.section.key, count=HUB_PAGE_SIZE)).init()
+            server = plexapp.SERVERMANAGER.selectedServer
+            packed = []
+            hubs = HubsList(server.hubs(self.section.key, count=HUB_PAGE_SIZE, packed=packed)).init(packed)
+            hubcache.HUB_CACHE.put(server, self.section.key, packed)
             if self.isCanceled():
                 return
             self.callback(self.section, hubs)
@@ -77,11 +90,19 @@ class SectionHubsTask(backgroundthread.Task):
 
 
 class UpdateHubTask(backgroundthread.Task):
+    taskClass = backgroundthread.SPECULATIVE
+
     def setup(self, hub, callback):
         self.hub = hub
         self.callback = callback
         return self
 
+    def getServer(self):
+        return plexapp.SERVERMANAGER.selectedServer
+
+    def describe(self):
+        return self.hub.hubIdentifier
+
     def run(self):
         if self.isCanceled():
             return
@@ -106,6 +127,12 @@ class ExtendHubTask(backgroundthread.Task):
         self.canceledCallback = canceledCallback
         return self
 
+    def getServer(self):
+        return plexapp.SERVERMANAGER.selectedServer
+
+    def describe(self):
+        return self.hub.hubIdentifier
+
     def run(self):
         if self.isCanceled():
             if self.canceledCallback:
@@ -714,11 +741,67 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
             self.checkSectionItem(force=True)
 
     def sectionHubsCallback(self, section, hubs):
+        changed = ()
         with self.lock:
-            update = bool(self.sectionHubs.get(section.key))
+            old = self.sectionHubs.get(section.key)
             self.sectionHubs[section.key] = hubs
             if self.lastSection == section:
-                self.showHubs(section, update=update)
+                changed = self.getChangedHubs(old, hubs)
+                if changed is None:
+                    self.showHubs(section, update=bool(old))
+
+        for hub in changed or ():
+            self.updateHubCallback(hub)
+
+    def getChangedHubs(self, old, new):
+        # When fresh hubs replace cached ones with the same layout, only the hubs that differ need redrawing
+        if not old or not old.cached or not new or old.packed is None or new.packed is None:
+            return None
+
+        if [p[1].get('hubIdentifier') for p in old.packed] != [p[1].get('hubIdentifier') for p in new.packed]:
+            return None
+
+        for hub in new:
+            identifier = hub.getCleanHubIdentifier()
+            if identifier in self.updateHubs:
+                self.updateHubs[identifier] = hub
+
+        changed = []
+        for hub, oldPacked, newPacked in zip(new, old.packed, new.packed):
+            if oldPacked != newPacked:
+                changed.append(hub)
+            else:
+                self.rebindHub(hub)
+
+        util.DEBUG_LOG('Revalidated cached hubs: {0} of {1} changed'.format(len(changed), len(new)))
+        return changed
+
+    def rebindHub(self, hub):
+        # Cached hubs have their own items, point an unchanged hub's list items at the fresh shared ones
+        identifier = hub.getCleanHubIdentifier()
+        if identifier not in self.HUBMAP:
+            return
+
+        control = self.hubControls[self.HUBMAP[identifier]['index']]
+        if not control.dataSource or control.dataSource.hubIdentifier != hub.hubIdentifier:
+            return
+
+        control.dataSource = hub
+        for mli, obj in zip(control, hub.items):
+            if mli.dataSource and mli.dataSource.ratingKey == obj.ratingKey:
+                mli.dataSource = obj
+
+    def getCachedHubs(self, section):
+        server = plexapp.SERVERMANAGER.selectedServer
+        packed = hubcache.HUB_CACHE.get(server, section.key)
+        if not packed:
+            return None
+
+        try:
+            return HubsList(server.hubsFromPacked(packed, section.key)).init(packed, cached=True)
+        except Exception:
+            util.ERROR('Failed to load cached hubs')
+            return None
 
     def updateHubCallback(self, hub, items=None):
         with self.lock:
@@ -763,6 +846,9 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
             return
 
         if plexapp.SERVERMANAGER.selectedServer.hasHubs():
+            cached = self.getCachedHubs(HomeSection)
+            if cached is not None:
+                self.sectionHubs[HomeSection.key] = cached
             self.tasks = [SectionHubsTask().setup(s, self.sectionHubsCallback) for s in [HomeSection, PlaylistsSection] + sections]
             backgroundthread.BGThreader.addTasks(self.tasks)
 
@@ -814,11 +900,19 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver):
             self.setBoolProperty('no.content', True)
             return
 
-        if not hubs:
+        if hubs is None and not update:
+            # Draw the last known hubs while this section's task fetches them again
+            hubs = self.getCachedHubs(section)
+            if hubs is not None:
+                self.sectionHubs[section.key] = hubs
+
+        if not hubs or hubs.cached:
             for task in self.tasks:
-                if task.section == section:
+                if getattr(task, 'section', None) == section and task.isValid():
                     backgroundthread.BGThreader.moveToFront(task)
                     break
+
+        if not hubs:
             return
 
         if time.time() - hubs.lastUpdated > HUBS_REFRESH_INTERVAL:
@@ -13,6 +13,7 @@ from . import kodigui
 from lib import colors
 from lib import util
 from lib import backgroundthread
+from lib import chunkcache
 
 from . import busy
 from . import subitems
@@ -24,6 +25,7 @@ from . import opener
 from . import windowutils
 
 from plexnet import playqueue
+from plexnet import plexobjects
 
 from lib.util import T
 import six
@@ -31,6 +33,8 @@ from six.moves import range
 
 CHUNK_SIZE = 200
 # CHUNK_SIZE = 30
+PARTIAL_CHUNK_SIZE = 50  # Streamed items are handed to the window in batches of this size
+PENDING_CHUNK_WAIT = 10  # Longest a chunk request waits for a prefetch of the same chunk before fetching it itself
 
 KEYS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
@@ -143,7 +147,7 @@ def setItemType(type_=None):
 
 
 class ChunkRequestTask(backgroundthread.Task):
-    def setup(self, section, start, size, callback, filter_=None, sort=None, unwatched=False):
+    def setup(self, section, start, size, callback, filter_=None, sort=None, unwatched=False, cache=None, prefetch=False):
         self.section = section
         self.start = start
         self.size = size
@@ -151,8 +155,18 @@ class ChunkRequestTask(backgroundthread.Task):
         self.filter = filter_
         self.sort = sort
         self.unwatched = unwatched
+        self.cache = cache
+        self.prefetch = prefetch
+        if prefetch:
+            self.taskClass = backgroundthread.SPECULATIVE
         return self
 
+    def getServer(self):
+        return self.section.server
+
+    def describe(self):
+        return '{0} {1}-{2}{3}'.format(self.section.key, self.start, self.start + self.size, self.prefetch and ' prefetch' or '')
+
     def contains(self, pos):
         return self.start <= pos <= (self.start + self.size)
 
@@ -166,13 +180,65 @@ class ChunkRequestTask(backgroundthread.Task):
                 type_ = 4
             elif ITEM_TYPE == 'album':
                 type_ = 9
-            items = self.section.all(self.start, self.size, self.filter, self.sort, self.unwatched, type_=type_)
-            if self.isCanceled():
-                return
-            self.callback(items, self.start)
+
+            if self.cache:
+                key = (self.start, self.size, self.filter, self.sort, self.unwatched, type_)
+                items = self.cache.get(key)
+                if items is None:
+                    pending = self.cache.startFetch(key)
+                    if pending:
+                        # A prefetch of this chunk is on its way, wait for it instead of fetching it twice
+                        if self.prefetch:
+                            return
+                        deadline = time.time() + PENDING_CHUNK_WAIT
+                        while not pending.is_set() and time.time() < deadline:
+                            if self.isCanceled():
+                                return
+                            pending.wait(0.1)
+                        items = self.cache.get(key)
+                        if items is None:
+                            self.fetch(type_)
+                        elif not self.isCanceled():
+                            self.callback(items, self.start)
+                        return
+
+                    items = None
+                    fetchStart = time.time()
+                    try:
+                        items = self.fetch(type_)
+                    finally:
+                        self.cache.endFetch(key, items, time.time() - fetchStart)
+                elif not self.prefetch and not self.isCanceled():
+                    self.callback(items, self.start)
+            else:
+                self.fetch(type_)
         except plexnet.exceptions.BadRequest:
             util.DEBUG_LOG('404 on section: {0}'.format(repr(self.section.title)))
 
+    def fetch(self, type_):
+        # Returns the whole chunk, or None if it was canceled or the response was cut short.
+        # A cut short chunk is still shown, but not cached.
+        items = []
+        rendered = 0
+        stream = self.section.iterAll(self.start, self.size, self.filter, self.sort, self.unwatched, type_=type_)
+        for item in stream:
+            if self.isCanceled():
+                return None
+
+            items.append(item)
+            if not self.prefetch and len(items) - rendered >= PARTIAL_CHUNK_SIZE:
+                self.callback(items, self.start, rendered=rendered, partial=True)
+                rendered = len(items)
+
+        if self.isCanceled():
+            return None
+        if not self.prefetch:
+            self.callback(list(items), self.start, rendered=rendered)
+        if not stream.complete:
+            util.DEBUG_LOG('Incomplete chunk for section {0}: {1}'.format(repr(self.section.title), self.start))
+            return None
+        return items
+
 
 class PhotoPropertiesTask(backgroundthread.Task):
     def setup(self, photo, callback):
@@ -180,6 +246,12 @@ class PhotoPropertiesTask(backgroundthread.Task):
         self.callback = callback
         return self
 
+    def getServer(self):
+        return self.photo.server
+
+    def describe(self):
+        return self.photo.ratingKey
+
     def run(self):
         if self.isCanceled():
             return
@@ -412,6 +484,10 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
         self.dragging = False
 
+        self.chunkCache = chunkcache.ChunkCache()
+        self.scrollVelocity = 0
+        self.lastScroll = None
+
         self.cleared = True
         self.librarySettings = LibrarySettings(self.section)
         self.reset()
@@ -719,11 +795,34 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         if self.scrollBar:
             self.scrollBar.setPosition(pos)
 
+        self.updateScrollVelocity(pos)
+
         if self.chunkMode.posIsForward(pos):
             self.shiftChunks()
         elif self.chunkMode.posIsBackward(pos):
             self.shiftChunks(-1)
 
+    def updateScrollVelocity(self, pos):
+        now = time.time()
+        if self.lastScroll:
+            lastPos, lastTime = self.lastScroll
+            elapsed = now - lastTime
+            if elapsed > 2:
+                self.scrollVelocity = 0
+            elif elapsed > 0:
+                self.scrollVelocity = self.scrollVelocity * 0.5 + (abs(pos - lastPos) / elapsed) * 0.5
+
+        self.lastScroll = (pos, now)
+
+    def getPrefetchCount(self):
+        return self.chunkCache.getPrefetchCount(self.scrollVelocity, CHUNK_SIZE)
+
+    def chunkRequestTask(self, start, prefetch=False):
+        return ChunkRequestTask().setup(
+            self.section, start, CHUNK_SIZE, self.chunkCallback, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched,
+            cache=self.chunkMode and self.chunkCache or None, prefetch=prefetch
+        )
+
     def shiftChunks(self, mod=1):
         start = self.chunkMode.shift(mod)
         if start is None:
@@ -733,13 +832,22 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
             self.chunkCallback([None] * CHUNK_SIZE, -CHUNK_SIZE)
         else:
             self.chunkCallback([False] * CHUNK_SIZE, start)
-            task = ChunkRequestTask().setup(
-                self.section, start, CHUNK_SIZE, self.chunkCallback, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched
-            )
+            task = self.chunkRequestTask(start)
 
             self.tasks.add(task)
             backgroundthread.BGThreader.addTasksToFront([task])
 
+        prefetch = []
+        for x in range(1, self.getPrefetchCount() + 1):
+            pStart = start + (CHUNK_SIZE * mod * x)
+            if pStart < 0 or pStart >= self.chunkMode.itemCount:
+                break
+            prefetch.append(self.chunkRequestTask(pStart, prefetch=True))
+
+        if prefetch:
+            self.tasks.add(prefetch)
+            backgroundthread.BGThreader.addTasks(prefetch)
+
     def selectKey(self, mli=None):
         if not mli:
             mli = self.showPanelControl.getSelectedItem()
@@ -789,15 +897,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
         tasks = []
         for x in range(mul):
-            task = ChunkRequestTask().setup(
-                self.section,
-                start + (CHUNK_SIZE * x),
-                CHUNK_SIZE,
-                self.chunkCallback,
-                filter_=self.getFilterOpts(),
-                sort=self.getSortOpts(),
-                unwatched=self.filterUnwatched
-            )
+            task = self.chunkRequestTask(start + (CHUNK_SIZE * x))
 
             self.tasks.add(task)
             tasks.append(task)
@@ -1246,6 +1346,9 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
     def fill(self):
         if self.chunkMode:
             self.chunkMode.reset()
+        self.chunkCache.clear()
+        self.lastScroll = None
+        self.scrollVelocity = 0
 
         if self.section.TYPE in ('photo', 'photodirectory'):
             self.fillPhotos()
@@ -1359,11 +1462,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         tasks = []
         ct = 0
         for start in range(0, totalSize, CHUNK_SIZE):
-            tasks.append(
-                ChunkRequestTask().setup(
-                    self.section, start, CHUNK_SIZE, self.chunkCallback, filter_=self.getFilterOpts(), sort=self.getSortOpts(), unwatched=self.filterUnwatched
-                )
-            )
+            tasks.append(self.chunkRequestTask(start))
             ct += 1
 
             if self.chunkMode and ct > 1:
@@ -1488,7 +1587,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
         if keys:
             util.setGlobalProperty('key', keys[0])
 
-    def chunkCallback(self, items, start, clear=False):
+    def chunkCallback(self, items, start, clear=False, rendered=0, partial=False):
         if clear:
             with self.lock:
                 items = [kodigui.ManagedListItem('') for i in range(CHUNK_SIZE * 3)]
@@ -1501,28 +1600,36 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
         if self.cleared:
             self.cleared = False
-            busy.widthDialog(self._chunkCallback, self, items, start)
+            busy.widthDialog(self._chunkCallback, self, items, start, rendered, partial)
         else:
-            self._chunkCallback(items, start)
+            self._chunkCallback(items, start, rendered, partial)
 
-    def _chunkCallback(self, items, start):
+    def _chunkCallback(self, items, start, rendered=0, partial=False):
+        # While a chunk is still streaming in, items holds everything received so
+        # far and the first `rendered` of them are already on screen.
         if self.chunkMode and not self.chunkMode.posIsValid(start):
             return
 
         with self.lock:
             if self.chunkMode and not self.chunkMode.posIsValid(start):
                 return
-            pos = start
             self.setBackground(items)
             thumbDim = TYPE_KEYS.get(self.section.type, TYPE_KEYS['movie'])['thumb_dim']
             artDim = TYPE_KEYS.get(self.section.type, TYPE_KEYS['movie']).get('art_dim', (256, 256))
 
             showUnwatched = True if self.section.TYPE in ('movie', 'show') else False
 
-            if self.chunkMode and len(items) < CHUNK_SIZE:
+            if self.chunkMode and not partial and len(items) < CHUNK_SIZE:
                 items += [None] * (CHUNK_SIZE - len(items))
 
+            pos = start + rendered
+            items = items[rendered:]
+
             if ITEM_TYPE == 'episode':
+                columns = plexobjects.ItemColumns(items)
+                durations = columns.durations()
+                viewCounts = columns.ints('viewCount')
+                airDates = columns.timestamps('originallyAvailableAt')
                 for offset, obj in enumerate(items):
                     mli = self.showPanelControl[pos]
                     if obj:
@@ -1531,7 +1638,7 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
                         if obj.index:
                             subtitle = u' - {0}{1} \u2022 {2}{3}'.format(T(32310, 'S'), obj.parentIndex, T(32311, 'E'), obj.index)
                         else:
-                            subtitle = ' - ' + obj.originallyAvailableAt.asDatetime('%m/%d/%y')
+                            subtitle = ' - ' + (airDates[offset] and time.strftime('%m/%d/%y', time.localtime(airDates[offset])) or '')
                         mli.setLabel((obj.defaultTitle or '') + subtitle)
 
                         # mli.setThumbnailImage(obj.defaultThumb.asTranscodedImageURL(*thumbDim))
@@ -1540,9 +1647,9 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
                         # # mli.setProperty('key', self.chunkMode.getKey(pos))
 
-                        mli.setLabel2(util.durationToText(obj.fixedDuration()))
+                        mli.setLabel2(util.durationToText(durations[offset]))
                         mli.setProperty('art', obj.defaultArt.asTranscodedImageURL(*artDim))
-                        if not obj.isWatched:
+                        if not viewCounts[offset]:
                             mli.setProperty('unwatched', '1')
                     else:
                         mli.clear()
@@ -1581,6 +1688,14 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
 
                     pos += 1
             else:
+                if showUnwatched:
+                    columns = plexobjects.ItemColumns(items)
+                    durations = columns.durations()
+                    if self.section.TYPE == 'show':
+                        leafCounts = columns.ints('leafCount')
+                        viewedLeafCounts = columns.ints('viewedLeafCount')
+                    else:
+                        viewCounts = columns.ints('viewCount')
                 for offset, obj in enumerate(items):
                     mli = self.showPanelControl[pos]
                     if obj:
@@ -1594,13 +1709,13 @@ class LibraryWindow(kodigui.MultiWindow, windowutils.UtilMixin):
                             mli.setProperty('key', self.chunkMode.getKey(pos))
 
                         if showUnwatched:
-                            mli.setLabel2(util.durationToText(obj.fixedDuration()))
+                            mli.setLabel2(util.durationToText(durations[offset]))
                             mli.setProperty('art', obj.defaultArt.asTranscodedImageURL(*artDim))
-                            if not obj.isWatched:
-                                if self.section.TYPE == 'show':
-                                    mli.setProperty('unwatched.count', str(obj.unViewedLeafCount))
-                                else:
-                                    mli.setProperty('unwatched', '1')
+                            if self.section.TYPE == 'show':
+                                if viewedLeafCounts[offset] != leafCounts[offset]:
+                                    mli.setProperty('unwatched.count', str(leafCounts[offset] - viewedLeafCounts[offset]))
+                            elif not viewCounts[offset]:
+                                mli.setProperty('unwatched', '1')
                     else:
                         mli.clear()
                         if obj is False:
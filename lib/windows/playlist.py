@@ -41,6 +41,12 @@ class ChunkRequestTask(backgroundthread.Task):
     def contains(self, pos):
         return self.start <= pos <= (self.start + self.size)
 
+    def getServer(self):
+        return self.WINDOW and self.WINDOW.playlist.server
+
+    def describe(self):
+        return '{0}-{1}'.format(self.start, self.start + self.size)
+
     def run(self):
         if self.isCanceled():
             return
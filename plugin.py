@@ -21,7 +21,7 @@ util.LOG = LOG
 
 
 def playTrack(track):
-    track.reload()
+    track.softReload()
     apobj = plexplayer.PlexAudioPlayer(track)
     url = apobj.build()['url']
     url = util.addURLParams(url, {
@@ -0,0 +1,10 @@
+from __future__ import absolute_import
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# plexnet is imported as a top level package, like the add-on does
+for path in (os.path.join(ROOT, 'lib', '_included_packages'), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
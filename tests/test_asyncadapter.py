@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from plexnet import asyncadapter
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='Stalled connects rely on Linux listen backlog behaviour')
+
+
+class Listener(object):
+    def __init__(self, host='127.0.0.1', stalled=False):
+        self.sock = socket.socket()
+        self.sock.bind((host, 0))
+        self.sock.listen(0)
+        self.address = self.sock.getsockname()
+        self._fillers = []
+        if stalled:
+            # A full accept queue drops further SYNs, so connects to it hang
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(self.address)
+            self._fillers.append(filler)
+            time.sleep(0.1)
+
+    def close(self):
+        for s in self._fillers + [self.sock]:
+            s.close()
+
+
+@pytest.fixture
+def listener():
+    listener = Listener()
+    yield listener
+    listener.close()
+
+
+@pytest.fixture
+def stalled():
+    listener = Listener(stalled=True)
+    yield listener
+    listener.close()
+
+
+def connect(address, timeout=5):
+    conn = asyncadapter.AsyncVerifiedHTTPSConnection(address[0], address[1])
+    return conn, lambda: conn.create_connection(address, timeout=timeout)
+
+
+def test_connects_to_listener(listener):
+    conn, create = connect(listener.address)
+    start = time.time()
+    sock = create()
+    try:
+        assert sock.getpeername() == listener.address
+        assert time.time() - start < 0.5
+    finally:
+        sock.close()
+
+
+def test_stalled_connect_times_out(stalled):
+    conn, create = connect(stalled.address, timeout=0.5)
+    start = time.time()
+    with pytest.raises(asyncadapter.TimeoutException):
+        create()
+    assert 0.4 < time.time() - start < 2
+
+
+def test_cancel_wakes_stalled_connect(stalled):
+    conn, create = connect(stalled.address, timeout=10)
+    threading.Timer(0.2, conn.cancel).start()
+    start = time.time()
+    with pytest.raises(asyncadapter.CanceledException):
+        create()
+    # Woken by the self-pipe, not by the timeout
+    assert time.time() - start < 1
+
+
+def test_abort_flag_cancels_stalled_connect(stalled, monkeypatch):
+    abortAt = time.time() + 0.2
+    monkeypatch.setattr(asyncadapter, 'ABORT_FLAG_FUNCTION', lambda: time.time() >= abortAt)
+    conn, create = connect(stalled.address, timeout=10)
+    start = time.time()
+    with pytest.raises(asyncadapter.CanceledException):
+        create()
+    assert time.time() - start < 1
+
+
+def resolveTo(monkeypatch, *addresses):
+    results = [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', address) for address in addresses]
+    monkeypatch.setattr(socket, 'getaddrinfo', lambda *args, **kwargs: list(results))
+
+
+def test_race_skips_stalled_first_address(stalled, monkeypatch):
+    good = Listener('127.0.0.2')
+    try:
+        resolveTo(monkeypatch, stalled.address, good.address)
+        conn = asyncadapter.AsyncVerifiedHTTPSConnection('race.test', 32400)
+        start = time.time()
+        sock = conn.create_connection(('race.test', 32400), timeout=10)
+        try:
+            assert sock.getpeername() == good.address
+            # The second attempt starts CONNECT_ATTEMPT_DELAY after the first, not after its timeout
+            assert time.time() - start < asyncadapter.CONNECT_ATTEMPT_DELAY + 0.5
+        finally:
+            sock.close()
+
+        stats = asyncadapter.ADDRESS_STATS.getStats('race.test', 32400)
+        assert stats['127.0.0.2']['successes'] == 1
+        assert not stats.get('127.0.0.1', {}).get('successes')
+
+        # The winner goes first next time
+        ordered = asyncadapter.ADDRESS_STATS.sortAddresses('race.test', 32400, socket.getaddrinfo('race.test', 32400))
+        assert [res[4] for res in ordered] == [good.address, stalled.address]
+    finally:
+        good.close()
+
+
+def test_refused_address_moves_on_without_delay(listener, monkeypatch):
+    closed = socket.socket()
+    closed.bind(('127.0.0.3', 0))
+    refused = closed.getsockname()
+    closed.close()
+
+    resolveTo(monkeypatch, refused, listener.address)
+    conn = asyncadapter.AsyncVerifiedHTTPSConnection('refused.test', 32400)
+    start = time.time()
+    sock = conn.create_connection(('refused.test', 32400), timeout=10)
+    try:
+        assert sock.getpeername() == listener.address
+        assert time.time() - start < asyncadapter.CONNECT_ATTEMPT_DELAY
+    finally:
+        sock.close()
+
+    stats = asyncadapter.ADDRESS_STATS.getStats('refused.test', 32400)
+    assert stats['127.0.0.3']['failures'] == 1
+    ordered = asyncadapter.ADDRESS_STATS.sortAddresses('refused.test', 32400, socket.getaddrinfo('refused.test', 32400))
+    assert [res[4] for res in ordered] == [listener.address, refused]
+
+
+def test_interleaves_address_families():
+    v6 = [(socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::%d' % i, 1, 0, 0)) for i in range(2)]
+    v4 = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.%d' % i, 1)) for i in range(2)]
+    ordered = asyncadapter.ADDRESS_STATS.sortAddresses('families.test', 1, v6 + v4)
+    assert ordered == [v6[0], v4[0], v6[1], v4[1]]
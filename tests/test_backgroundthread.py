@@ -0,0 +1,222 @@
+from __future__ import absolute_import
+import importlib
+import sys
+import types
+
+import pytest
+import six.moves.queue
+
+
+class _Monitor(object):
+    def abortRequested(self):
+        return False
+
+
+def _fakeModules(tmpdir):
+    # backgroundthread only needs these bits of Kodi and lib.util
+    kodi = types.ModuleType('kodi_six')
+    kodi.xbmc = types.ModuleType('kodi_six.xbmc')
+
+    util = types.ModuleType('lib.util')
+    util.MONITOR = _Monitor()
+    util.advancedSettings = types.SimpleNamespace(debugTasks=False)
+    util.PROFILE = str(tmpdir)
+    util.LOG = util.DEBUG_LOG = util.ERROR = lambda *args, **kwargs: None
+
+    return {'kodi_six': kodi, 'kodi_six.xbmc': kodi.xbmc, 'lib.util': util}
+
+
+@pytest.fixture(scope='module')
+def bgt(tmp_path_factory):
+    fakes = _fakeModules(tmp_path_factory.mktemp('profile'))
+    names = list(fakes) + ['lib.backgroundthread']
+    saved = dict((name, sys.modules.get(name)) for name in names)
+    sys.modules.update(fakes)
+    sys.modules.pop('lib.backgroundthread', None)
+    try:
+        yield importlib.import_module('lib.backgroundthread')
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+class Server(object):
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+def makeTask(bgt, priority, server=None, taskClass=None, name=None):
+    class T(bgt.Task):
+        def getServer(self):
+            return server
+
+    task = T(priority)
+    task.name = name
+    if taskClass:
+        task.taskClass = taskClass
+    return task
+
+
+def drain(q):
+    tasks = []
+    while True:
+        try:
+            tasks.append(q.get_nowait())
+        except six.moves.queue.Empty:
+            return tasks
+
+
+def test_heap_pops_in_priority_then_insertion_order(bgt):
+    heap = bgt.TaskHeap()
+    tasks = []
+    for order, priority in enumerate((5, 1, 3, 1, 4, 2)):
+        task = bgt.Task(priority)
+        task._queueOrder = order
+        tasks.append(task)
+        heap.push(task)
+
+    popped = [heap.pop() for _ in range(len(heap))]
+    assert [(t._priority, t._queueOrder) for t in popped] == [(1, 1), (1, 3), (2, 5), (3, 2), (4, 4), (5, 0)]
+    assert not any(heap.contains(t) for t in tasks)
+    assert all(t._queueIndex is None for t in tasks)
+
+
+def test_heap_update_moves_task_both_ways(bgt):
+    heap = bgt.TaskHeap()
+    tasks = [bgt.Task(p) for p in range(10)]
+    for order, task in enumerate(tasks):
+        task._queueOrder = order
+        heap.push(task)
+
+    last, first = tasks[9], tasks[0]
+    last._priority = -1
+    heap.update(last, 9)
+    first._priority = 100
+    heap.update(first, 0)
+
+    for task in tasks:
+        assert heap.contains(task)
+        assert heap.heap[task._queueIndex] is task
+
+    popped = [heap.pop() for _ in range(len(heap))]
+    assert popped[0] is last
+    assert popped[-1] is first
+    assert [t._priority for t in popped] == sorted(t._priority for t in popped)
+
+
+def test_server_lane_is_capped(bgt):
+    q = bgt.MutablePriorityQueue()
+    slow, other = Server('slow'), Server('other')
+    for p in range(6):
+        q.put(makeTask(bgt, p, slow))
+    for p in range(10, 12):
+        q.put(makeTask(bgt, p, other))
+
+    started = drain(q)
+    assert [t.getServer() for t in started] == [slow] * bgt.SERVER_MAX_TASKS + [other] * 2
+    # Two tasks for the slow server are still queued, but none can start
+    assert q.pending() == 2
+    assert q.qsize() == 0
+
+    q.taskDone(started[0])
+    reopened = drain(q)
+    assert len(reopened) == 1
+    assert reopened[0].getServer() is slow
+
+
+def test_tasks_without_a_server_are_not_capped(bgt):
+    q = bgt.MutablePriorityQueue()
+    for p in range(bgt.SERVER_MAX_TASKS * 2):
+        q.put(makeTask(bgt, p))
+
+    assert len(drain(q)) == bgt.SERVER_MAX_TASKS * 2
+
+
+def test_task_classes_share_by_weight(bgt):
+    q = bgt.MutablePriorityQueue()
+    for p in range(40):
+        q.put(makeTask(bgt, p, taskClass=bgt.SPECULATIVE))
+    for p in range(100, 140):
+        q.put(makeTask(bgt, p, taskClass=bgt.INTERACTIVE))
+
+    started = [q.get_nowait() for _ in range(25)]
+    interactive = sum(1 for t in started if t.taskClass == bgt.INTERACTIVE)
+    weights = bgt.TASK_CLASS_WEIGHTS
+    assert interactive == 25 * weights[bgt.INTERACTIVE] // (weights[bgt.INTERACTIVE] + weights[bgt.SPECULATIVE])
+
+    # Speculative tasks still run, in their own priority order
+    speculative = [t._priority for t in started if t.taskClass == bgt.SPECULATIVE]
+    assert speculative == list(range(len(speculative)))
+
+    waits = q.waitStats()
+    assert waits[bgt.INTERACTIVE][0] == interactive
+    assert waits[bgt.SPECULATIVE][0] == 25 - interactive
+
+
+def test_idle_class_does_not_catch_up(bgt):
+    q = bgt.MutablePriorityQueue()
+    for p in range(20):
+        q.put(makeTask(bgt, p))
+    drain(q)
+
+    # Interactive tasks ran alone before the queue emptied, which earns speculative nothing
+    for p in range(10):
+        q.put(makeTask(bgt, p, taskClass=bgt.SPECULATIVE))
+    for p in range(10, 20):
+        q.put(makeTask(bgt, p))
+
+    started = [q.get_nowait() for _ in range(5)]
+    assert sum(1 for t in started if t.taskClass == bgt.INTERACTIVE) == 4
+
+
+def test_cancelled_tasks_are_dropped(bgt):
+    q = bgt.MutablePriorityQueue()
+    tasks = [makeTask(bgt, p) for p in range(3)]
+    for task in tasks:
+        q.put(task)
+
+    tasks[0].cancel()
+    tasks[1].cancel()
+    assert q.get_nowait() is tasks[2]
+    assert q.unfinished_tasks == 1
+
+
+def test_new_generation_drops_older_tasks(bgt):
+    q = bgt.MutablePriorityQueue()
+    old = [makeTask(bgt, p) for p in range(3)]
+    for task in old:
+        q.put(task)
+
+    q.newGeneration()
+    new = makeTask(bgt, 10)
+    q.put(new)
+
+    assert q.get_nowait() is new
+    assert all(t._canceled and t._cancelReason == 'reset' for t in old)
+    assert q.pending() == 0
+
+
+def test_move_to_front_keeps_order(bgt):
+    q = bgt.MutablePriorityQueue()
+    tasks = [makeTask(bgt, p, name=p) for p in range(6)]
+    for task in tasks:
+        q.put(task)
+
+    q.moveToFront([tasks[4], tasks[5]])
+    assert q.lowest() is tasks[4]
+    assert [t.name for t in drain(q)] == [4, 5, 0, 1, 2, 3]
+
+
+def test_reprioritize(bgt):
+    q = bgt.MutablePriorityQueue()
+    tasks = [makeTask(bgt, p) for p in range(3)]
+    for task in tasks:
+        q.put(task)
+
+    assert q.reprioritize(tasks[2], -1)
+    assert q.get_nowait() is tasks[2]
+    # No longer queued
+    assert not q.reprioritize(tasks[2], 5)
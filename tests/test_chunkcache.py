@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+import threading
+
+from lib import chunkcache
+
+
+def test_get_returns_a_copy():
+    cache = chunkcache.ChunkCache()
+    cache.startFetch('a')
+    cache.endFetch('a', [1, 2], 0.5)
+
+    items = cache.get('a')
+    items.append(3)
+    assert cache.get('a') == [1, 2]
+    assert cache.get('b') is None
+
+
+def test_evicts_least_recently_used():
+    cache = chunkcache.ChunkCache(size=2)
+    for key in ('a', 'b'):
+        cache.startFetch(key)
+        cache.endFetch(key, [key], 0.5)
+
+    cache.get('a')
+    cache.startFetch('c')
+    cache.endFetch('c', ['c'], 0.5)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == ['a']
+    assert cache.get('c') == ['c']
+
+
+def test_second_fetch_waits_for_the_first():
+    cache = chunkcache.ChunkCache()
+    assert cache.startFetch('a') is None
+
+    pending = cache.startFetch('a')
+    assert pending is not None
+    assert not pending.is_set()
+
+    results = []
+
+    def waiter():
+        pending.wait(5)
+        results.append(cache.get('a'))
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    cache.endFetch('a', ['item'], 0.5)
+    thread.join(5)
+
+    assert results == [['item']]
+    # Done, the next fetch of it is a new one
+    assert cache.startFetch('a') is None
+
+
+def test_failed_fetch_releases_waiters_without_caching():
+    cache = chunkcache.ChunkCache()
+    cache.startFetch('a')
+    pending = cache.startFetch('a')
+    cache.endFetch('a', None, 0.5)
+
+    assert pending.is_set()
+    assert cache.get('a') is None
+    assert cache.fetchTime == 1.0
+
+
+def test_fetch_time_average():
+    cache = chunkcache.ChunkCache()
+    cache.startFetch('a')
+    cache.endFetch('a', [], 2.0)
+    assert abs(cache.fetchTime - 1.3) < 1e-9
+
+
+def test_clear_keeps_pending_fetches():
+    cache = chunkcache.ChunkCache()
+    cache.startFetch('a')
+    cache.endFetch('a', ['a'], 0.5)
+    cache.startFetch('b')
+
+    cache.clear()
+
+    assert cache.get('a') is None
+    assert cache.startFetch('b') is not None
+
+
+def test_prefetch_count_follows_scroll_velocity():
+    cache = chunkcache.ChunkCache()
+    cache.fetchTime = 1.0
+
+    assert cache.getPrefetchCount(0, 200) == 1
+    assert cache.getPrefetchCount(300, 200) == 2
+    assert cache.getPrefetchCount(10000, 200) == chunkcache.MAX_PREFETCH_CHUNKS
+
+    # Slower fetches need more chunks in flight for the same speed
+    cache.fetchTime = 2.0
+    assert cache.getPrefetchCount(300, 200) == 3
@@ -0,0 +1,147 @@
+from __future__ import absolute_import
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer, socketserver
+
+from plexnet import asynctransport
+from plexnet import http
+from plexnet import plexserver
+from plexnet import util
+
+ETAG = '"v1"'
+BODY = b'<MediaContainer size="1"><Video ratingKey="1" type="movie" title="A"/></MediaContainer>'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.seen.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class Interface(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def getPreference(self, pref, default=None):
+        return True if pref == 'asyncio_transport' else default
+
+
+@pytest.fixture
+def server(monkeypatch):
+    if not asynctransport.AVAILABLE:
+        pytest.skip('Needs the asyncio transport')
+
+    httpd = Server(('127.0.0.1', 0), Handler)
+    httpd.seen = []
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    transport = asynctransport.AsyncTransport()
+    monkeypatch.setattr(asynctransport, 'TRANSPORT', transport)
+    monkeypatch.setattr(util, 'INTERFACE', Interface())
+    monkeypatch.setattr(http, 'RESPONSE_CACHE', http.ResponseCache())
+
+    server = plexserver.PlexServer()
+    base = 'http://127.0.0.1:{0}'.format(httpd.server_port)
+    server.buildUrl = lambda path, includeToken=False: base + path + '?X-Plex-Token=abc'
+    server.httpd = httpd
+    yield server
+
+    transport.shutdown()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_304_returns_cached_tree(server):
+    first = server.query('/library/metadata/1')
+    second = server.query('/library/metadata/1')
+
+    assert first is not None
+    assert second is first
+    assert server.httpd.seen[0].get('If-None-Match') is None
+    assert server.httpd.seen[1].get('If-None-Match') == ETAG
+
+
+def test_validators_keep_caller_headers(server):
+    server.query('/library/metadata/1', headers={'X-Test': '1'})
+    server.query('/library/metadata/1', headers={'X-Test': '2'})
+
+    assert [h.get('X-Test') for h in server.httpd.seen] == ['1', '2']
+    assert server.httpd.seen[1].get('If-None-Match') == ETAG
+
+
+def test_invalidate_refetches(server):
+    first = server.query('/library/metadata/1')
+    http.RESPONSE_CACHE.invalidate('/library/metadata/1')
+    second = server.query('/library/metadata/1')
+
+    assert second is not first
+    assert server.httpd.seen[1].get('If-None-Match') is None
+
+
+class Response(object):
+    def __init__(self, etag=ETAG):
+        self.headers = {'ETag': etag}
+
+
+def test_invalidate_matches_whole_path_segments():
+    cache = http.ResponseCache()
+    for path in ('/library/metadata/12', '/library/metadata/12/children', '/library/metadata/123'):
+        cache.store(cache.getKey('http://pms' + path), Response(), path, 10)
+
+    cache.invalidate('/library/metadata/12')
+
+    assert cache.get(cache.getKey('http://pms/library/metadata/12')) is None
+    assert cache.get(cache.getKey('http://pms/library/metadata/12/children')) is None
+    assert cache.get(cache.getKey('http://pms/library/metadata/123')) == '/library/metadata/123'
+    assert cache.size == 10
+
+
+def test_keys_ignore_token():
+    cache = http.ResponseCache()
+    assert cache.getKey('http://pms/a?X-Plex-Token=1&b=2') == cache.getKey('http://pms/a', {'b': 2, 'X-Plex-Token': '3'})
+
+
+def test_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(http.ResponseCache, 'MAX_SIZE', 30)
+    cache = http.ResponseCache()
+    keys = [cache.getKey('http://pms/{0}'.format(i)) for i in range(3)]
+    for key in keys:
+        cache.store(key, Response(), key, 10)
+
+    cache.get(keys[0])
+    cache.store(cache.getKey('http://pms/3'), Response(), None, 10)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.size == 30
+
+
+def test_uncacheable_responses_are_not_stored():
+    cache = http.ResponseCache()
+    key = cache.getKey('http://pms/a')
+    cache.store(key, Response(etag=None), 'tree', 10)
+    assert cache.get(key) is None
+    assert cache.getValidators(key) == {}
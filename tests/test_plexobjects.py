@@ -0,0 +1,212 @@
+from __future__ import absolute_import
+import json
+import time
+import zlib
+from xml.etree import ElementTree
+
+import pytest
+
+from plexnet import exceptions
+from plexnet import plexconnection
+from plexnet import plexobjects
+from plexnet import plexserver
+from plexnet import video  # Registers the library types
+
+
+@pytest.fixture
+def server():
+    # No uuid, so items stay out of the identity map unless a test sets one
+    return plexserver.PlexServer()
+
+
+def build(server, xml, initpath='/library/metadata'):
+    return plexobjects.buildItem(server, ElementTree.fromstring(xml), initpath)
+
+
+def test_missing_attributes_share_one_na_value(server):
+    movie = build(server, '<Video ratingKey="1" type="movie" title="A"/>')
+
+    missing = movie.grandparentTitle
+    assert missing == ''
+    assert missing.NA
+    assert movie.parentTitle is missing
+    assert 'grandparentTitle' not in movie.__dict__
+    assert 'parentTitle' not in movie.__dict__
+    assert missing.parent is movie
+
+
+def test_na_default_idiom(server):
+    movie = build(server, '<Video ratingKey="1" type="movie" title="A"/>')
+
+    value = movie.grandparentTitle('fallback')
+    assert value == 'fallback'
+    assert not value.NA
+    assert value is not movie.grandparentTitle
+    assert movie.grandparentTitle == ''
+    assert movie.title('fallback') == 'A'
+
+
+def test_present_attributes_are_not_na(server):
+    movie = build(server, '<Video ratingKey="1" type="movie" title="A"/>')
+
+    assert movie.title == 'A'
+    assert not movie.title.NA
+    assert movie.title.parent is movie
+
+
+def test_na_values_are_per_object(server):
+    a = build(server, '<Video ratingKey="1" type="movie"/>')
+    b = build(server, '<Video ratingKey="2" type="movie"/>')
+
+    assert a.grandparentTitle is not b.grandparentTitle
+    assert b.grandparentTitle.parent is b
+
+
+COLUMN_ITEMS = (
+    '<Video ratingKey="1" type="episode" duration="1500000" viewCount="2" originallyAvailableAt="2019-03-04" addedAt="1551657600"/>',
+    '<Video ratingKey="2" type="episode" duration="45" originallyAvailableAt="" addedAt="1551657601"/>',
+    '<Video ratingKey="3" type="movie" duration="" viewCount="0" originallyAvailableAt="2019-13-40"/>',
+    '<Directory ratingKey="4" type="show" leafCount="10" viewedLeafCount="4"/>',
+)
+
+
+@pytest.fixture
+def columnItems(server):
+    return [build(server, xml) for xml in COLUMN_ITEMS] + [None, False]
+
+
+def test_columns_match_item_accessors(columnItems):
+    items = [item for item in columnItems if item]
+    columns = plexobjects.ItemColumns(items)
+
+    assert list(columns.durations()) == [item.fixedDuration() for item in items]
+    assert list(columns.ints('viewCount')) == [item.viewCount.asInt() for item in items]
+    assert list(columns.ints('leafCount')) == [item.leafCount.asInt() for item in items]
+    assert list(columns.ints('viewedLeafCount')) == [item.viewedLeafCount.asInt() for item in items]
+    assert [bool(v) for v in columns.ints('viewCount')[:3]] == [item.isWatched for item in items[:3]]
+
+
+def test_timestamps(columnItems):
+    dates = plexobjects.ItemColumns(columnItems).timestamps('originallyAvailableAt')
+    assert time.strftime('%Y-%m-%d', time.localtime(dates[0])) == '2019-03-04'
+    # Missing, malformed and placeholder entries are 0 instead of raising
+    assert list(dates[1:]) == [0] * 5
+
+    added = plexobjects.ItemColumns(columnItems).timestamps('addedAt')
+    assert list(added[:2]) == [1551657600, 1551657601]
+
+
+def test_placeholders_get_the_default(columnItems):
+    columns = plexobjects.ItemColumns(columnItems)
+    assert list(columns.ints('viewCount', default=-1)[-2:]) == [-1, -1]
+    assert list(columns.durations()[-2:]) == [0, 0]
+
+
+def test_columns_see_changed_values(columnItems):
+    episode = columnItems[1]
+    episode.viewCount = plexobjects.PlexValue('1', episode)
+    assert plexobjects.ItemColumns([episode]).ints('viewCount')[0] == 1
+
+
+def test_list_columns(server, columnItems):
+    container = plexobjects.ItemContainer(columnItems[:2]).init(None)
+    assert list(container.columns().ints('viewCount')) == [2, 0]
+
+
+MOVIE = (
+    '<Video ratingKey="7" key="/library/metadata/7" type="movie" title="A" viewOffset="5000">'
+    '<Media id="1" duration="10"><Part id="2" key="/library/parts/2/file.mkv"/></Media>'
+    '</Video>'
+)
+
+
+@pytest.fixture
+def connectedServer():
+    return plexserver.PlexServer.deSerialize(json.dumps({
+        'uuid': 'serialize-uuid',
+        'name': 'PMS',
+        'connections': [{
+            'sources': plexconnection.PlexConnection.SOURCE_MANUAL,
+            'address': 'http://127.0.0.1:32400',
+            'isLocal': True,
+            'token': 'token',
+            'active': True
+        }]
+    }))
+
+
+@pytest.fixture
+def identityMap():
+    plexobjects.IDENTITY_MAP.clear()
+    yield plexobjects.IDENTITY_MAP
+    plexobjects.IDENTITY_MAP.clear()
+
+
+def roundTrip(obj):
+    data = obj.serialize()
+    # The plugin gets a fresh process, with nothing to merge into
+    plexobjects.IDENTITY_MAP.clear()
+    return plexobjects.PlexObject.deSerialize(data)
+
+
+def test_serialize_round_trip(connectedServer, identityMap):
+    movie = build(connectedServer, MOVIE, '/library/metadata/7')
+    data = movie.serialize()
+    assert data.startswith(plexobjects.SERIALIZE_MAGIC)
+
+    restored = roundTrip(movie)
+    assert restored is not movie
+    assert type(restored) is type(movie)
+    assert restored.title == 'A'
+    assert restored.viewOffset.asInt() == 5000
+    assert restored.media[0].parts[0].key == '/library/parts/2/file.mkv'
+    assert restored.server.uuid == 'serialize-uuid'
+    assert restored.server.activeConnection.address == 'http://127.0.0.1:32400'
+
+
+def test_fresh_full_state_skips_soft_reload(connectedServer, identityMap, monkeypatch):
+    restored = roundTrip(build(connectedServer, MOVIE, '/library/metadata/7'))
+    assert restored._reloaded
+
+    def query(*args, **kwargs):
+        raise AssertionError('softReload() should not query the server')
+
+    monkeypatch.setattr(plexobjects.RELOADS, 'query', query)
+    assert restored.softReload() is restored
+
+
+def test_old_state_is_reloaded(connectedServer, identityMap, monkeypatch):
+    data = build(connectedServer, MOVIE, '/library/metadata/7').serialize()
+    plexobjects.IDENTITY_MAP.clear()
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + plexobjects.SERIALIZE_MAX_AGE + 1)
+    restored = plexobjects.PlexObject.deSerialize(data)
+
+    assert restored.title == 'A'
+    assert not restored._reloaded
+
+
+def test_state_without_media_is_reloaded(connectedServer, identityMap):
+    restored = roundTrip(build(connectedServer, '<Video ratingKey="8" key="/library/metadata/8" type="movie" title="B"/>'))
+    assert restored.title == 'B'
+    assert not restored._reloaded
+
+
+def test_unknown_version_is_rejected(connectedServer, identityMap):
+    data = build(connectedServer, MOVIE, '/library/metadata/7').serialize()
+    version, created, serverData, packed = json.loads(zlib.decompress(data[len(plexobjects.SERIALIZE_MAGIC):]).decode('utf-8'))
+    data = plexobjects.SERIALIZE_MAGIC + zlib.compress(json.dumps([version + 1, created, serverData, packed]).encode('utf-8'))
+
+    with pytest.raises(exceptions.UnknownType):
+        plexobjects.PlexObject.deSerialize(data)
+
+
+def test_json_serialization_still_loads(connectedServer, identityMap):
+    # The plugin hands over base64 decoded bytes
+    data = build(connectedServer, MOVIE, '/library/metadata/7').serializeJSON().encode('utf-8')
+    plexobjects.IDENTITY_MAP.clear()
+
+    restored = plexobjects.PlexObject.deSerialize(data)
+    assert restored.key == '/library/metadata/7'
+    assert not restored._reloaded